@@ -1,11 +1,82 @@
 import argparse
+import os
+import signal
 
-from src.api.api_server import ApiServer
+from src.api.api_server import ApiServer, ServerModes
+from src.blockchain.write_ahead_log import DurabilityMode
+from src.log_config import configure_logging
+from src.p2p.admission_control import EvictionPolicy
+from src.p2p.wait_time_scheduler import SchedulerTypes, create_scheduler
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Start Blockchain node")
     parser.add_argument("--api_port", type=int, help="Port to interact with blockchain via API")
     parser.add_argument("--p2p_port", type=int, help="Port for your node to communicate with other nodes in the network")
+    parser.add_argument("--signing_workers", type=int, default=os.cpu_count(),
+                        help="Processes used to sign transactions, 0 signs inline in the request thread")
+    parser.add_argument("--wal_path", type=str, help="Write-ahead log of accepted transactions and blocks, "
+                                                    "replayed on startup. Disabled when not set")
+    parser.add_argument("--wal_mode", type=str, default=DurabilityMode.BATCHED,
+                        choices=[DurabilityMode.REQUEST, DurabilityMode.BATCHED, DurabilityMode.OFF],
+                        help="fsync per request, batched across concurrent requests, or no fsync")
+    parser.add_argument("--max_pending", type=int,
+                        help="Maximum number of pending transactions, unlimited when not set")
+    parser.add_argument("--eviction_policy", type=str, default=EvictionPolicy.REJECT,
+                        choices=[EvictionPolicy.REJECT, EvictionPolicy.EVICT_OLDEST],
+                        help="What happens to a new transaction when the pending pool is full")
+    parser.add_argument("--client_rate", type=float, help="API requests per second per client, unlimited when not set")
+    parser.add_argument("--client_burst", type=float, help="API request burst per client, defaults to the rate")
+    parser.add_argument("--p2p_workers", type=int, default=32, help="Threads handling P2P connections")
+    parser.add_argument("--p2p_queue_size", type=int, default=256,
+                        help="P2P connections waiting for a worker before new ones are closed")
+    parser.add_argument("--peer_rate", type=float,
+                        help="P2P connections per second per peer, unlimited when not set")
+    parser.add_argument("--peer_burst", type=float, help="P2P connection burst per peer, defaults to the rate")
+    parser.add_argument("--log_level", type=str, default="INFO", help="Log level of the whole node")
+    parser.add_argument("--log_sample_rate", type=float, default=1.0,
+                        help="Share of per-message log events (P2P messages, API calls) that are written")
+    parser.add_argument("--log_sync", action="store_true",
+                        help="Write logs from the calling thread instead of a background queue listener")
+    parser.add_argument("--server", type=str, default=ServerModes.DEVELOPMENT,
+                        choices=[ServerModes.DEVELOPMENT, ServerModes.PRODUCTION],
+                        help="Flask development server or multi-threaded waitress WSGI server")
+    parser.add_argument("--server_threads", type=int, default=8, help="Worker threads of the production server")
+    parser.add_argument("--connection_limit", type=int, default=100,
+                        help="Simultaneous connections accepted by the production server")
+    parser.add_argument("--request_timeout", type=int, default=120,
+                        help="Seconds an idle or slow keep-alive connection is kept by the production server")
+    parser.add_argument("--sync_workers", type=int, default=os.cpu_count(),
+                        help="Processes verifying blocks during chain sync, 0 verifies in the handler thread")
+    parser.add_argument("--wait_time_scheduler", type=str, default=SchedulerTypes.UNIFORM,
+                        choices=[SchedulerTypes.UNIFORM, SchedulerTypes.EXPONENTIAL],
+                        help="PoET wait time distribution, has to be the same on every validator")
+    parser.add_argument("--target_block_interval", type=float, default=1.0,
+                        help="Seconds between blocks the exponential scheduler aims for")
+    parser.add_argument("--wait_time_resolution", type=float,
+                        help="Wait time granularity in seconds, 1 for uniform and 0.001 for exponential by default")
+    parser.add_argument("--trace_capacity", type=int, default=10000,
+                        help="Transactions whose lifecycle timestamps are kept for /transactions/<id>/trace, "
+                             "0 disables tracing")
+    parser.add_argument("--max_block_transactions", type=int, default=1000,
+                        help="Transactions per proposed block, unlimited when 0")
+    parser.add_argument("--max_block_bytes", type=int, default=1000000,
+                        help="Serialized transaction bytes per proposed block, unlimited when 0")
     args = parser.parse_args()
 
-    ApiServer(args.api_port, args.p2p_port)
\ No newline at end of file
+    log_listener = configure_logging(args.log_level, args.log_sample_rate, not args.log_sync)
+    server = ApiServer(args.api_port, args.p2p_port, args.signing_workers, args.wal_path, args.wal_mode,
+                       args.max_pending, args.eviction_policy, args.client_rate, args.client_burst, args.p2p_workers,
+                       args.p2p_queue_size, args.peer_rate, args.peer_burst, args.server, args.server_threads,
+                       args.connection_limit, args.request_timeout, args.sync_workers,
+                       create_scheduler(args.wait_time_scheduler, args.target_block_interval,
+                                        args.wait_time_resolution),
+                       args.trace_capacity, args.max_block_transactions or None, args.max_block_bytes or None)
+
+    def stop(signum, frame):
+        # Serving threads can't be interrupted, the process exits once worker pools and the WAL are closed
+        server.shutdown()
+        if log_listener is not None:
+            log_listener.stop()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
@@ -0,0 +1,75 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import requests
+
+EXPORT_KINDS = ["blocks", "transactions", "votes"]
+
+
+def find_resume_point(path: str):
+    # Offset where the lines of the last exported height begin and that height. The last height is exported again
+    # since its lines may be incomplete, a partial trailing line is dropped as well
+    offset, resume_offset, resume_height, last_height = 0, 0, 0, None
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            height = json.loads(line)["height"]
+            if height != last_height:
+                resume_offset, resume_height, last_height = offset, height, height
+            offset += len(line)
+    return resume_offset, resume_height
+
+
+def export(args):
+    params = {"from_height": args.from_height}
+    for name in ("to_height", "contract", "method", "candidate"):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+
+    mode = "wb"
+    if args.resume and os.path.exists(args.output):
+        offset, params["from_height"] = find_resume_point(args.output)
+        with open(args.output, "r+b") as f:
+            f.truncate(offset)
+        mode = "ab"
+        logging.info(f"Resuming {args.output} at height {params['from_height']}, offset {offset}")
+
+    started = time.time()
+    lines = 0
+    with requests.get(f"{args.node}/export/{args.kind}", params=params, stream=True, timeout=args.timeout) as response:
+        response.raise_for_status()
+        with open(args.output, mode) as f:
+            for line in response.iter_lines(chunk_size=args.chunk_size):
+                if not line:
+                    continue
+                f.write(line + b"\n")
+                lines += 1
+                if lines % args.report_every == 0:
+                    logging.info(f"{lines} {args.kind} exported, {lines / (time.time() - started):.0f}/s")
+    logging.info(f"Exported {lines} {args.kind} to {args.output} in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Export blocks, transactions or votes of a node as NDJSON")
+    parser.add_argument("kind", type=str, choices=EXPORT_KINDS, help="What to export")
+    parser.add_argument("--node", type=str, default="http://127.0.0.1:6000", help="API url of the node")
+    parser.add_argument("--output", type=str, required=True, help="NDJSON file to write")
+    parser.add_argument("--from_height", type=int, default=0, help="First block height to export")
+    parser.add_argument("--to_height", type=int, help="Last block height to export, the current tip when not set")
+    parser.add_argument("--contract", type=str, help="Only transactions of this contract, required for votes")
+    parser.add_argument("--method", type=str, help="Only transactions calling this contract method")
+    parser.add_argument("--candidate", type=str, help="Only votes for this candidate")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted export into --output from its last exported height")
+    parser.add_argument("--chunk_size", type=int, default=65536, help="Bytes read from the response at once")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for the node")
+    parser.add_argument("--report_every", type=int, default=10000, help="Lines between progress reports")
+    parsed = parser.parse_args()
+    if parsed.kind == "votes" and parsed.contract is None:
+        parser.error("--contract is required to export votes")
+    export(parsed)
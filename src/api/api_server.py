@@ -1,36 +1,81 @@
 import logging
+import queue
 import threading
+import time
 
 import rsa
-from flask import Flask, jsonify, request
+import waitress
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 
+from src.api import ledger_export
+from src.api.response_cache import ResponseCache
+from src.api.signing_service import SigningService
 from src.blockchain.blockchain import Blockchain
 from src.blockchain.contract_methods import ContractMethods
 from src.blockchain.status import Status
 from src.blockchain.transaction import Transaction
+from src.blockchain.transaction_trace import TraceStages
+from src.blockchain.write_ahead_log import DurabilityMode, WriteAheadLogError
+from src.log_config import SAMPLED
+from src.p2p.admission_control import EvictionPolicy, NodeBusyError, RateLimiter
 from src.p2p.p2p_server import P2PServer
 
-logging.basicConfig(level=logging.DEBUG)
+
+class ServerModes:
+    DEVELOPMENT = "development"  # Flask built-in server
+    PRODUCTION = "production"  # multi-threaded waitress WSGI server
+
+
+class InvalidTransactionError(Exception):
+    pass
+
+
+class MissingFieldsError(InvalidTransactionError):
+    pass
 
 
 class ApiServer:
-    def __init__(self, api_port, p2p_port):
+    def __init__(self, api_port, p2p_port, signing_workers=None, wal_path=None, wal_mode=DurabilityMode.BATCHED,
+                 max_pending=None, eviction_policy=EvictionPolicy.REJECT, client_rate=None, client_burst=None,
+                 p2p_workers=32, p2p_queue_size=256, peer_rate=None, peer_burst=None,
+                 server_mode=ServerModes.DEVELOPMENT, server_threads=8, connection_limit=100, request_timeout=120,
+                 sync_workers=0, wait_time_scheduler=None, trace_capacity=10000, max_block_transactions=None,
+                 max_block_bytes=None):
         # Sample data structures for transactions and validators
-        self.blockchain = Blockchain()
+        self.blockchain = Blockchain(max_pending, eviction_policy, trace_capacity, max_block_transactions,
+                                     max_block_bytes)
+        if wal_path:
+            self.blockchain.open_wal(wal_path, wal_mode)
         self.public_key, self.private_key = rsa.newkeys(512)
+        # Without workers transactions are signed inline in the request thread
+        self.signing_service = SigningService(self.private_key, signing_workers) if signing_workers else None
 
         self.app = Flask(__name__)
         CORS(self.app)
-        self.p2p_server = P2PServer('localhost', p2p_port, self.blockchain)
+        self.app.register_error_handler(queue.Full, self.signing_queue_full)
+        self.app.register_error_handler(NodeBusyError, self.node_busy)
+        self.app.register_error_handler(WriteAheadLogError, self.wal_failed)
+        self.client_limiter = RateLimiter(client_rate, client_burst)
+        self.app.before_request(self.mark_received)
+        self.app.before_request(self.limit_client_rate)
+        self.p2p_server = P2PServer('localhost', p2p_port, self.blockchain, p2p_workers, p2p_queue_size, peer_rate,
+                                    peer_burst, sync_workers, wait_time_scheduler)
+        self.response_cache = ResponseCache()
 
         # Register the endpoints with the app
         self.app.add_url_rule('/votes/new', 'add_transaction', self.new_vote, methods=['POST'])
+        self.app.add_url_rule('/transactions/new', 'add_signed_transaction', self.new_signed_transaction,
+                              methods=['POST'])
+        self.app.add_url_rule('/transactions/bulk', 'add_signed_transactions', self.new_signed_transactions,
+                              methods=['POST'])
         self.app.add_url_rule('/validators/register', 'register_validator', self.register_validator, methods=['POST'])
         self.app.add_url_rule('/transactions', 'get_transaction', self.get_transactions, methods=['GET'])
         self.app.add_url_rule('/validators', 'get_validators', self.get_validators, methods=['GET'])
         self.app.add_url_rule('/blockchain', 'get_blockchain', self.get_blockchain, methods=['GET'])
         self.app.add_url_rule('/peers', 'get_nodes', self.get_peers, methods=['GET'])
+        self.app.add_url_rule('/peers/stats', 'get_peer_stats', self.get_peer_stats, methods=['GET'])
+        self.app.add_url_rule('/p2p/traffic', 'get_p2p_traffic', self.get_p2p_traffic, methods=['GET'])
         self.app.add_url_rule('/peers/new', 'connect_to_peer', self.connect_to_peer, methods=['POST'])
         self.app.add_url_rule('/sync', 'sync_with_peers', self.sync_with_peers, methods=['GET'])
         self.app.add_url_rule('/contracts/new', 'create_contract', self.new_contract, methods=['POST'])
@@ -43,17 +88,51 @@ class ApiServer:
         self.app.add_url_rule('/contracts', 'get_contracts', self.get_contracts, methods=['GET'])
         self.app.add_url_rule('/contract/results', 'get_results', self.get_results, methods=['GET'])
         self.app.add_url_rule('/key/public', 'get_public_key', self.get_public_key, methods=['GET'])
-
-        # Define a lambda function to wrap self.app.run
-        run_server = lambda port: self.app.run(port=port)
-
-        # Create a new thread to run self.app.run in parallel
-        thread1 = threading.Thread(target=run_server, args=(api_port,))
+        self.app.add_url_rule('/blocks/<block_hash>', 'get_block_by_hash', self.get_block_by_hash, methods=['GET'])
+        self.app.add_url_rule('/blocks/height/<int:height>', 'get_block_by_height', self.get_block_by_height,
+                              methods=['GET'])
+        self.app.add_url_rule('/transactions/<tx_id>', 'get_transaction_by_id', self.get_transaction, methods=['GET'])
+        self.app.add_url_rule('/contracts/<contract_name>/voters/<fingerprint>', 'get_vote', self.get_vote,
+                              methods=['GET'])
+        self.app.add_url_rule('/transactions/<tx_id>/proof', 'get_transaction_proof', self.get_transaction_proof,
+                              methods=['GET'])
+        self.app.add_url_rule('/transactions/<tx_id>/trace', 'get_transaction_trace', self.get_transaction_trace,
+                              methods=['GET'])
+        self.app.add_url_rule('/traces/stages', 'get_trace_stages', self.get_trace_stages, methods=['GET'])
+        self.app.add_url_rule('/export/blocks', 'export_blocks', self.export_blocks, methods=['GET'])
+        self.app.add_url_rule('/export/transactions', 'export_transactions', self.export_transactions, methods=['GET'])
+        self.app.add_url_rule('/export/votes', 'export_votes', self.export_votes, methods=['GET'])
+        self.app.add_url_rule('/consensus/interval', 'get_block_interval', self.get_block_interval, methods=['GET'])
+
+        self.server_mode = server_mode
+        self.server_threads = server_threads
+        self.connection_limit = connection_limit
+        self.request_timeout = request_timeout
+
+        # Create a new thread to run the API server in parallel with P2P and consensus
+        thread1 = threading.Thread(target=self.serve, args=(api_port,))
         thread2 = threading.Thread(target=self.p2p_server.start)
 
         thread1.start()
         thread2.start()
 
+    def serve(self, port):
+        if self.server_mode == ServerModes.PRODUCTION:
+            # HTTP/1.1 keep-alive connections are kept open until request_timeout seconds of inactivity
+            waitress.serve(self.app, host='127.0.0.1', port=port, threads=self.server_threads,
+                           connection_limit=self.connection_limit, channel_timeout=self.request_timeout)
+        else:
+            self.app.run(port=port)
+
+    def shutdown(self):
+        # Worker processes are joined, their resource usage then counts towards this process
+        logging.info("Shutting down")
+        if self.signing_service is not None:
+            self.signing_service.shutdown()
+        self.p2p_server.p2p_node.sync_pipeline.shutdown()
+        if self.blockchain.wal is not None:
+            self.blockchain.wal.close()
+
     def new_vote(self):
         # Get the candidate name from the request data
         data = request.get_json()
@@ -65,21 +144,141 @@ class ApiServer:
         candidate_name = request.json['candidate']
         tx = Transaction(self.public_key, contract_name, ContractMethods.VOTE, [self.public_key, candidate_name])
         # Create a new transaction and add it to the blockchain
-        result, status = self.blockchain.add_transaction(tx, self.private_key)
-        logging.info(f"Executed vote. Result: {result}, status: {status}")
+        self.sign_transaction(tx)
+        result, status = self.add_transaction(tx)
+        logging.info("Executed vote. Result: %s, status: %s", result, status, extra=SAMPLED)
+        if result:
+            if status == Status.NEW_BLOCK:
+                self.p2p_server.start_validating()
+                return jsonify({'result': "Vote added and new block created", 'transaction_id': tx.get_id()}), 201
+            else:
+                self.p2p_server.broadcast_pending_transactions()
+                return jsonify({'result': "Vote added", 'transaction_id': tx.get_id()}), 201
+        return jsonify({'result': "Smth went wrong"}), 400
+
+    def sign_transaction(self, tx: Transaction):
+        if self.signing_service is None:
+            tx.sign(self.private_key)
+        else:
+            self.signing_service.sign(tx)
+        g.signed_at = time.time()
+
+    @staticmethod
+    def mark_received():
+        g.received_at = time.time()
+
+    def trace_received(self, tx: Transaction):
+        # Recorded only once the transaction is admitted, refused ones would push real traces out of the tracer
+        self.blockchain.tracer.record(tx.get_id(), TraceStages.RECEIVED, g.received_at)
+        if 'signed_at' in g:
+            self.blockchain.tracer.record(tx.get_id(), TraceStages.SIGNED, g.signed_at)
+
+    def add_transaction(self, tx: Transaction):
+        result, status = self.blockchain.add_transaction(tx)
+        if status == Status.MEMPOOL_FULL:
+            raise NodeBusyError("Pending transaction pool is full")
+        if result:
+            self.trace_received(tx)
+        return result, status
+
+    def limit_client_rate(self):
+        if not self.client_limiter.allow(request.remote_addr):
+            raise NodeBusyError(f"Rate limit exceeded for {request.remote_addr}")
+
+    def node_busy(self, e):
+        logging.warning("Rejecting request: %s", e, extra=SAMPLED)
+        return jsonify({'result': f"Node is busy: {e}"}), 429, {'Retry-After': '1'}
+
+    def signing_queue_full(self, e):
+        logging.warning("Signing queue is full, rejecting request")
+        return jsonify({'result': "Node is busy, try again later"}), 503
+
+    def wal_failed(self, e):
+        logging.error("Rejecting request: %s", e, extra=SAMPLED)
+        return jsonify({'result': "Transaction could not be logged durably"}), 503
+
+    @staticmethod
+    def parse_signed_transaction(data) -> Transaction:
+        # Raises InvalidTransactionError with the reason the transaction is refused
+        required_fields = ['voter_key', 'contract_name', 'contract_method', 'args', 'timestamp', 'signature']
+        if not all(field in data for field in required_fields):
+            raise MissingFieldsError("Missing fields")
+        try:
+            tx = Transaction.from_dict(data)
+        except Exception as e:
+            logging.exception(e)
+            raise InvalidTransactionError("Malformed transaction")
+        if not tx.verify():
+            raise InvalidTransactionError("Invalid signature")
+        if tx.contract_method == ContractMethods.VOTE and tx.args[0] != tx.voter_key:
+            raise InvalidTransactionError("Vote must be signed by the voter")
+        return tx
+
+    def new_signed_transaction(self):
+        # Accept a transaction that was already signed by the client with its own voter key
+        data = request.get_json()
+        try:
+            tx = self.parse_signed_transaction(data)
+        except MissingFieldsError:
+            return 'Missing fields', 400
+        except InvalidTransactionError as e:
+            return jsonify({'result': str(e)}), 400
+
+        result, status = self.add_transaction(tx)
+        logging.info("Executed signed transaction. Result: %s, status: %s", result, status, extra=SAMPLED)
         if result:
             if status == Status.NEW_BLOCK:
                 self.p2p_server.start_validating()
-                return jsonify({'result': "Vote added and new block created"}), 201
+                return jsonify({'result': "Transaction added and new block created",
+                                'transaction_id': tx.get_id()}), 201
             else:
                 self.p2p_server.broadcast_pending_transactions()
-                return jsonify({'result': "Vote added"}), 201
+                return jsonify({'result': "Transaction added", 'transaction_id': tx.get_id()}), 201
         return jsonify({'result': "Smth went wrong"}), 400
 
+    def new_signed_transactions(self):
+        # Bulk variant of /transactions/new for replaying pre-signed workloads. When the pending pool fills up the
+        # rest of the batch is left unprocessed and the client retries it after Retry-After
+        data = request.get_json()
+        if 'transactions' not in data:
+            return 'Missing fields', 400
+
+        accepted, rejected, processed, status = 0, 0, 0, None
+        new_block = False
+        for tx_dict in data['transactions']:
+            try:
+                tx = self.parse_signed_transaction(tx_dict)
+            except InvalidTransactionError:
+                tx = None
+            if tx is not None:
+                result, status = self.blockchain.add_transaction(tx)
+                if status == Status.MEMPOOL_FULL:
+                    break
+                if result:
+                    self.trace_received(tx)
+                new_block = new_block or status == Status.NEW_BLOCK
+            else:
+                result = False
+            processed += 1
+            if result:
+                accepted += 1
+            else:
+                rejected += 1
+        logging.info("Executed bulk transactions. Accepted: %s, rejected: %s", accepted, rejected, extra=SAMPLED)
+
+        if new_block:
+            self.p2p_server.start_validating()
+        elif accepted:
+            self.p2p_server.broadcast_pending_transactions()
+        response = {'accepted': accepted, 'rejected': rejected, 'processed': processed}
+        if status == Status.MEMPOOL_FULL:
+            return jsonify(response), 429, {'Retry-After': '1'}
+        return jsonify(response), 201
+
     def register_validator(self):
         # Add the validator to the set of validators
         result = self.p2p_server.register_validator(self.public_key)
-        logging.info(f"Executed add validator. Result: {result}")
+        logging.info("Executed add validator. Result: %s", result, extra=SAMPLED)
 
         # Return the wait time as a response
         if result:
@@ -95,8 +294,9 @@ class ApiServer:
 
         tx = Transaction(self.public_key, name, ContractMethods.CREATE)
 
-        result, status = self.blockchain.add_transaction(tx, self.private_key)
-        logging.info(f"Executed add contract. Result: {result}, status: {status}")
+        self.sign_transaction(tx)
+        result, status = self.add_transaction(tx)
+        logging.info("Executed add contract. Result: %s, status: %s", result, status, extra=SAMPLED)
         if result:
             if status == Status.NEW_BLOCK:
                 self.p2p_server.start_validating()
@@ -117,8 +317,9 @@ class ApiServer:
 
         tx = Transaction(self.public_key, contract, ContractMethods.ADD_CANDIDATE, [candidate])
 
-        result, status = self.blockchain.add_transaction(tx, self.private_key)
-        logging.info(f"Executed add candidate to contract. Result: {result}, status: {status}")
+        self.sign_transaction(tx)
+        result, status = self.add_transaction(tx)
+        logging.info("Executed add candidate to contract. Result: %s, status: %s", result, status, extra=SAMPLED)
         if result:
             if status == Status.NEW_BLOCK:
                 self.p2p_server.start_validating()
@@ -135,9 +336,10 @@ class ApiServer:
             return 'Missing fields', 400
 
         contract_name = request.json['contract']
-        result = self.blockchain.get_candidates_for_contract(contract_name)
-        logging.info(f"Executed get candidates for contract. Result: {result}")
-        return jsonify({'result': result}), 200
+        logging.info("Executed get candidates for contract %s", contract_name, extra=SAMPLED)
+        return self.response_cache.get(
+            'candidates', contract_name, self.blockchain.version,
+            lambda: {'result': self.blockchain.get_candidates_for_contract(contract_name)})
 
     def start_contract(self):
         data = request.get_json()
@@ -149,8 +351,9 @@ class ApiServer:
 
         tx = Transaction(self.public_key, contract, ContractMethods.START_VOTING)
 
-        result, status = self.blockchain.add_transaction(tx, self.private_key)
-        logging.info(f"Executed start voting. Result: {result}, status: {status}")
+        self.sign_transaction(tx)
+        result, status = self.add_transaction(tx)
+        logging.info("Executed start voting. Result: %s, status: %s", result, status, extra=SAMPLED)
         if result:
             if status == Status.NEW_BLOCK:
                 self.p2p_server.start_validating()
@@ -170,8 +373,9 @@ class ApiServer:
 
         tx = Transaction(self.public_key, contract, ContractMethods.FINISH_VOTING)
 
-        result, status = self.blockchain.add_transaction(tx, self.private_key)
-        logging.info(f"Executed finish voting. Result: {result}, status: {status}")
+        self.sign_transaction(tx)
+        result, status = self.add_transaction(tx)
+        logging.info("Executed finish voting. Result: %s, status: %s", result, status, extra=SAMPLED)
         if result:
             if status == Status.NEW_BLOCK:
                 self.p2p_server.start_validating()
@@ -192,7 +396,7 @@ class ApiServer:
         port = request.json['port']
 
         result = self.p2p_server.connect_to_peer(host, port)
-        logging.info(f"Executed connect to peer. Result: {result}")
+        logging.info("Executed connect to peer. Result: %s", result, extra=SAMPLED)
 
         if result:
             return jsonify({"result": "Peer successfully connected"}), 201
@@ -201,7 +405,7 @@ class ApiServer:
 
     def sync_with_peers(self):
         result = self.p2p_server.sync()
-        logging.info(f"Executed connect to peer. Result: {result}")
+        logging.info("Executed connect to peer. Result: %s", result, extra=SAMPLED)
 
         if result:
             return jsonify({"result": "Peer successfully connected"}), 201
@@ -209,26 +413,32 @@ class ApiServer:
             return jsonify({"result": "Peer already exist"}), 204
 
     def get_transactions(self):
-        txs = [tx.to_dict() for tx in self.blockchain.pending_transactions]
-        return txs, 200
+        return self.response_cache.get('transactions', None, self.blockchain.version,
+                                       lambda: [tx.to_dict() for tx in self.blockchain.pending_transactions])
 
     def get_validators(self):
-        validators = self.p2p_server.p2p_node.validators
-        validators = [v.to_dict() for v in validators]
-        return validators, 200
+        node = self.p2p_server.p2p_node
+        # Validated blocks follow the chain, wait times and liveness follow the node and the registry
+        version = (self.blockchain.version, node.version, node.validators.version)
+        return self.response_cache.get('validators', None, version,
+                                       lambda: [v.to_dict() for v in node.validators])
 
     def get_blockchain(self):
         return Blockchain.to_dict(self.blockchain), 200
 
     def get_peers(self):
-        peers = [peer.to_dict() for peer in self.p2p_server.p2p_node.peers]
-        return peers, 200
+        node = self.p2p_server.p2p_node
+        return self.response_cache.get('peers', None, node.version, lambda: [peer.to_dict() for peer in node.peers])
+
+    def get_peer_stats(self):
+        peers = self.p2p_server.p2p_node.peers
+        return jsonify([peers.get_stats(peer) for peer in peers]), 200
+
+    def get_p2p_traffic(self):
+        return jsonify(self.p2p_server.get_traffic()), 200
 
     def get_contracts(self):
-        pending_contracts = [tx.contract_name for tx in self.blockchain.pending_transactions if
-                             tx.contract_method == ContractMethods.CREATE]
-        contracts = [contract for contract in self.blockchain.contracts]
-        return pending_contracts + contracts, 200
+        return self.response_cache.get('contracts', None, self.blockchain.version, self.blockchain.get_contract_names)
 
     def get_results(self):
         data = request.get_json()
@@ -237,8 +447,77 @@ class ApiServer:
             return 'Missing fields', 400
 
         contract = request.json['contract']
-        results = self.blockchain.get_results(contract)
-        return results, 200
+        return self.response_cache.get('results', contract, self.blockchain.version,
+                                       lambda: self.blockchain.get_results(contract))
 
     def get_public_key(self):
         return jsonify({"result": self.public_key.save_pkcs1().hex()}), 200
+
+    def get_block_by_hash(self, block_hash):
+        block = self.blockchain.get_block_by_hash(block_hash)
+        if block is None:
+            return jsonify({"result": "Block is not in the blockchain"}), 404
+        return jsonify({**block.to_dict(), "height": self.blockchain.index.get_block_height(block_hash)}), 200
+
+    def get_block_by_height(self, height):
+        block = self.blockchain.get_block_by_height(height)
+        if block is None:
+            return jsonify({"result": "Block is not in the blockchain"}), 404
+        return jsonify({**block.to_dict(), "height": height}), 200
+
+    def get_transaction(self, tx_id):
+        location = self.blockchain.get_transaction_location(tx_id)
+        if location is None:
+            return jsonify({"result": "Transaction is not in the blockchain"}), 404
+        return jsonify(location), 200
+
+    def get_vote(self, contract_name, fingerprint):
+        # fingerprint is sha256 of the voter public key in PKCS#1 PEM
+        location = self.blockchain.get_vote_location(contract_name, fingerprint)
+        if location is None:
+            return jsonify({"result": "Vote is not in the blockchain"}), 404
+        return jsonify(location), 200
+
+    def get_transaction_proof(self, tx_id):
+        # Merkle inclusion proof, verifiable against the block header with MerkleTree.verify_proof
+        proof = self.blockchain.get_transaction_proof(tx_id)
+        if proof is None:
+            return jsonify({"result": "Transaction is not in the blockchain"}), 404
+        return jsonify(proof), 200
+
+    def get_transaction_trace(self, tx_id):
+        trace = self.blockchain.tracer.get(tx_id)
+        if trace is None:
+            return jsonify({"result": "Transaction is not traced"}), 404
+        return jsonify(trace), 200
+
+    def get_trace_stages(self):
+        return jsonify(self.blockchain.tracer.get_stage_percentiles()), 200
+
+    def get_block_interval(self):
+        node = self.p2p_server.p2p_node
+        return jsonify(node.wait_time_scheduler.report(self.blockchain.chain)), 200
+
+    @staticmethod
+    def stream_ndjson(items):
+        # Chunked response written one line at a time, from_height of the last complete block resumes an export
+        return Response(stream_with_context(ledger_export.to_ndjson(items)), mimetype='application/x-ndjson')
+
+    def export_blocks(self):
+        from_height = request.args.get('from_height', 0, type=int)
+        to_height = request.args.get('to_height', None, type=int)
+        return self.stream_ndjson(ledger_export.iter_blocks(self.blockchain, from_height, to_height))
+
+    def export_transactions(self):
+        from_height = request.args.get('from_height', 0, type=int)
+        to_height = request.args.get('to_height', None, type=int)
+        return self.stream_ndjson(ledger_export.iter_transactions(
+            self.blockchain, from_height, to_height, request.args.get('contract'), request.args.get('method')))
+
+    def export_votes(self):
+        if 'contract' not in request.args:
+            return 'Missing fields', 400
+        from_height = request.args.get('from_height', 0, type=int)
+        to_height = request.args.get('to_height', None, type=int)
+        return self.stream_ndjson(ledger_export.iter_votes(
+            self.blockchain, request.args['contract'], from_height, to_height, request.args.get('candidate')))
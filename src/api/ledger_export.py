@@ -0,0 +1,61 @@
+import json
+from typing import Iterator
+
+from src.blockchain.blockchain import Blockchain
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import get_key_fingerprint
+
+
+def iter_heights(blockchain: Blockchain, from_height: int, to_height: int = None) -> Iterator[int]:
+    # The tip at the start of the export is the end unless to_height is given. Blocks are read one at a time,
+    # a reorganization that shortens the chain ends the export early
+    last_height = len(blockchain.chain) - 1 if to_height is None else min(to_height, len(blockchain.chain) - 1)
+    for height in range(max(0, from_height), last_height + 1):
+        if height >= len(blockchain.chain):
+            return
+        yield height
+
+
+def iter_blocks(blockchain: Blockchain, from_height: int, to_height: int = None) -> Iterator[dict]:
+    for height in iter_heights(blockchain, from_height, to_height):
+        yield {"height": height, **blockchain.chain[height].to_dict()}
+
+
+def iter_block_transactions(blockchain: Blockchain, from_height: int, to_height: int = None, contract_name: str = None,
+                            contract_method: str = None):
+    for height in iter_heights(blockchain, from_height, to_height):
+        block = blockchain.chain[height]
+        for position, tx in enumerate(block.transactions):
+            if contract_name is not None and tx.contract_name != contract_name:
+                continue
+            if contract_method is not None and tx.contract_method != contract_method:
+                continue
+            yield height, block, position, tx
+
+
+def iter_transactions(blockchain: Blockchain, from_height: int, to_height: int = None, contract_name: str = None,
+                      contract_method: str = None) -> Iterator[dict]:
+    for height, block, position, tx in iter_block_transactions(blockchain, from_height, to_height, contract_name,
+                                                               contract_method):
+        yield {"height": height, "block_hash": block.hash, "position": position, "transaction_id": tx.get_id(),
+               "transaction": tx.to_dict()}
+
+
+def iter_votes(blockchain: Blockchain, contract_name: str, from_height: int, to_height: int = None,
+               candidate: str = None) -> Iterator[dict]:
+    # Every vote transaction on the main chain, counted is False for the ones the contract rejected, e.g. a repeated
+    # vote of the same voter
+    for height, block, position, tx in iter_block_transactions(blockchain, from_height, to_height, contract_name,
+                                                               ContractMethods.VOTE):
+        if candidate is not None and tx.args[1] != candidate:
+            continue
+        voter = get_key_fingerprint(tx.voter_key)
+        yield {"height": height, "block_hash": block.hash, "position": position, "transaction_id": tx.get_id(),
+               "voter": voter, "candidate": tx.args[1], "timestamp": tx.timestamp,
+               "signature": tx.signature.hex() if tx.signature else None,
+               "counted": blockchain.index.get_vote_transaction_id(contract_name, voter) == tx.get_id()}
+
+
+def to_ndjson(items: Iterator[dict]) -> Iterator[str]:
+    for item in items:
+        yield json.dumps(item) + "\n"
@@ -0,0 +1,31 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+
+from flask import Response
+
+
+class ResponseCache:
+    # Serialized JSON bodies per (endpoint, key), served while the state version they were built from is current
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, endpoint: str, key, version, build) -> Response:
+        # The version is read by the caller before building, a write racing with build leaves an entry that is
+        # already outdated and gets rebuilt on the next read
+        with self.lock:
+            entry = self.entries.get((endpoint, key))
+            if entry is not None:
+                self.entries.move_to_end((endpoint, key))
+        if entry is not None and entry[0] == version:
+            body = entry[1]
+        else:
+            body = json.dumps(build())
+            with self.lock:
+                self.entries[(endpoint, key)] = (version, body)
+                self.entries.move_to_end((endpoint, key))
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return Response(body, status=200, mimetype="application/json")
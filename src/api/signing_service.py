@@ -0,0 +1,66 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List
+
+import rsa
+from rsa import PrivateKey
+
+from src.blockchain.transaction import Transaction
+
+
+def sign_messages(messages: List[bytes], private_key: PrivateKey) -> List[bytes]:
+    # Runs in a worker process, so pure-Python RSA does not hold the GIL of the API process
+    return [rsa.sign(message, private_key, 'SHA-256') for message in messages]
+
+
+class SigningService:
+    def __init__(self, private_key: PrivateKey, workers: int, max_batch_size: int = 32, max_queue_size: int = 1024):
+        self.private_key = private_key
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue(maxsize=max_queue_size)
+        # Limit batches in flight so queued requests stay in the bounded queue instead of the pool
+        self.in_flight = threading.Semaphore(workers * 2)
+        # multiprocessing.Pool keeps accepting work after the main thread of api.py returns, ProcessPoolExecutor doesn't
+        self.pool = multiprocessing.get_context('spawn').Pool(workers)
+        threading.Thread(target=self.dispatch, daemon=True).start()
+
+    def submit(self, transaction: Transaction) -> Future:
+        # Raises queue.Full when the service is saturated
+        future = Future()
+        self.requests.put_nowait((transaction, future))
+        return future
+
+    def sign(self, transaction: Transaction, timeout: float = None) -> Transaction:
+        return self.submit(transaction).result(timeout)
+
+    def dispatch(self):
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            self.in_flight.acquire()
+            messages = [tx.get_message() for tx, _ in batch]
+            self.pool.apply_async(sign_messages, (messages, self.private_key),
+                                  callback=lambda signatures, batch=batch: self.complete(batch, signatures),
+                                  error_callback=lambda e, batch=batch: self.fail(batch, e))
+
+    def complete(self, batch, signatures: List[bytes]):
+        self.in_flight.release()
+        for (tx, future), signature in zip(batch, signatures):
+            tx.set_signature(signature)
+            future.set_result(tx)
+
+    def fail(self, batch, e: BaseException):
+        self.in_flight.release()
+        logging.error("Signing batch failed: %s", e)
+        for _, future in batch:
+            future.set_exception(e)
+
+    def shutdown(self):
+        self.pool.terminate()
@@ -4,25 +4,35 @@ from hashlib import sha256
 
 from typing import List
 
+from src.blockchain.merkle_tree import MerkleTree
 from src.blockchain.transaction import Transaction
 
 
 class Block:
-    def __init__(self, transactions: List[Transaction], previous_hash: str, timestamp: float = None, hash: str = None):
+    def __init__(self, transactions: List[Transaction], previous_hash: str, timestamp: float = None, hash: str = None,
+                 merkle_root: str = None):
         self.timestamp = time.time() if timestamp is None else timestamp
         self.transactions = transactions
         self.previous_hash = previous_hash
+        self.merkle_root = self.calculate_merkle_root() if merkle_root is None else merkle_root
         self.hash = self.calculate_hash() if hash is None else hash
 
     def calculate_hash(self) -> str:
         block_string = json.dumps(self.hash_data(), sort_keys=True).encode()
         return sha256(block_string).hexdigest()
 
+    def calculate_merkle_root(self) -> str:
+        return self.get_merkle_tree().root
+
+    def get_merkle_tree(self) -> MerkleTree:
+        return MerkleTree([tx.get_id() for tx in self.transactions])
+
     def hash_data(self):
+        # Header only, transactions are committed through the Merkle root
         return {
             'timestamp': self.timestamp,
-            'transactions': [tx.to_dict() for tx in self.transactions],
             'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
         }
 
     def to_dict(self):
@@ -30,6 +40,7 @@ class Block:
             'timestamp': self.timestamp,
             'transactions': [tx.to_dict() for tx in self.transactions],
             'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
             'hash': self.hash,
         }
 
@@ -39,5 +50,6 @@ class Block:
             transactions=[Transaction.from_dict(tx) for tx in dict_['transactions']],
             previous_hash=dict_['previous_hash'],
             timestamp=dict_['timestamp'],
-            hash=dict_['hash']
+            hash=dict_['hash'],
+            merkle_root=dict_['merkle_root']
         )
\ No newline at end of file
@@ -0,0 +1,52 @@
+import json
+from collections import deque
+from typing import Iterable, List
+
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.contract_shard import ContractShard
+from src.blockchain.transaction import Transaction
+
+LIFECYCLE_METHODS = {ContractMethods.CREATE, ContractMethods.ADD_CANDIDATE, ContractMethods.START_VOTING,
+                     ContractMethods.FINISH_VOTING}
+
+
+class BlockTemplateBuilder:
+    # Picks the transactions of the next block within max_transactions and max_bytes (serialized transactions).
+    # Lifecycle transactions at the head of their contract go first, then contracts take one transaction each in turn,
+    # oldest head first. A contract's transactions keep their arrival order, they are executed in it
+    def __init__(self, max_transactions: int = None, max_bytes: int = None):
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+
+    def build(self, shards: Iterable[ContractShard]) -> List[Transaction]:
+        # Shards hold their transactions in arrival order
+        queues = [deque(shard.get_pending()) for shard in list(shards)]
+        queues = sorted((queue for queue in queues if queue), key=lambda queue: queue[0][0])
+        selected = []
+        size = 0
+
+        def take(queue: deque) -> bool:
+            # False once the block is full, a single transaction over max_bytes still gets a block of its own
+            nonlocal size
+            if self.max_transactions is not None and len(selected) >= self.max_transactions:
+                return False
+            entry = queue[0]
+            if self.max_bytes is not None:
+                tx_size = len(json.dumps(entry[1].to_dict()))
+                if selected and size + tx_size > self.max_bytes:
+                    return False
+                size += tx_size
+            selected.append(queue.popleft())
+            return True
+
+        full = False
+        for queue in queues:
+            while not full and queue and queue[0][1].contract_method in LIFECYCLE_METHODS:
+                full = not take(queue)
+        while not full and queues:
+            for queue in queues:
+                if queue and not take(queue):
+                    full = True
+                    break
+            queues = [queue for queue in queues if queue]
+        return [tx for _, tx in sorted(selected, key=lambda entry: entry[0])]
@@ -0,0 +1,61 @@
+from typing import Dict, List, Tuple
+
+from src.blockchain.block import Block
+
+
+class BlockNode:
+    def __init__(self, block: Block, height: int, parent: 'BlockNode' = None):
+        self.block = block
+        self.height = height
+        self.parent = parent
+        self.children: List[BlockNode] = []
+        # Inverse contract operations, recorded while the block is applied on the main chain
+        self.undo = []
+
+
+class BlockTree:
+    def __init__(self, genesis: Block):
+        root = BlockNode(genesis, 0)
+        self.nodes: Dict[str, BlockNode] = {genesis.hash: root}
+        self.tip = root
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self.nodes
+
+    def get(self, block_hash: str) -> BlockNode:
+        return self.nodes.get(block_hash)
+
+    def add(self, block: Block) -> BlockNode:
+        parent = self.nodes[block.previous_hash]
+        node = BlockNode(block, parent.height + 1, parent)
+        parent.children.append(node)
+        self.nodes[block.hash] = node
+        return node
+
+    def is_better_tip(self, node: BlockNode) -> bool:
+        # Fork choice: the highest chain wins, on equal height the first seen tip is kept
+        return node.height > self.tip.height
+
+    def get_fork_path(self, new_tip: BlockNode) -> Tuple[List[BlockNode], List[BlockNode]]:
+        # Blocks to roll back (from the current tip down) and blocks to apply (from the fork point up)
+        rollback, apply = [], []
+        old, new = self.tip, new_tip
+        while old.height > new.height:
+            rollback.append(old)
+            old = old.parent
+        while new.height > old.height:
+            apply.append(new)
+            new = new.parent
+        while old is not new:
+            rollback.append(old)
+            apply.append(new)
+            old, new = old.parent, new.parent
+        apply.reverse()
+        return rollback, apply
+
+    @classmethod
+    def from_chain(cls, chain: List[Block]):
+        obj = cls(chain[0])
+        for block in chain[1:]:
+            obj.tip = obj.add(block)
+        return obj
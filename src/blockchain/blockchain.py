@@ -1,118 +1,411 @@
+import itertools
 import logging
+from contextlib import ExitStack
 from threading import Lock
-from typing import Dict
-
-import rsa
+from typing import Dict, Iterable, List
 
 from src.blockchain.block import Block
+from src.blockchain.block_template import BlockTemplateBuilder
+from src.blockchain.block_tree import BlockTree, BlockNode
+from src.blockchain.chain_index import ChainIndex
 from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.contract_shard import ContractShard
 from src.blockchain.smart_contract import VotingSmartContract
 from src.blockchain.status import Status
 from src.blockchain.transaction import Transaction
+from src.blockchain.transaction_trace import TraceStages, TransactionTracer
+from src.blockchain.write_ahead_log import WriteAheadLog, RecordTypes
+from src.log_config import SAMPLED
+from src.p2p.admission_control import EvictionPolicy
 from src.p2p.validator import Validator
 
-logging.basicConfig(level=logging.DEBUG)
+EMPTY_SHARD = ContractShard("")
 
 
 class Blockchain:
-    def __init__(self):
+    def __init__(self, max_pending: int = None, eviction_policy: str = EvictionPolicy.REJECT,
+                 trace_capacity: int = 10000, max_block_transactions: int = None, max_block_bytes: int = None):
         self.chain = [self.create_genesis_block()]
-        self.pending_transactions = list()
+        self.block_tree = BlockTree(self.chain[0])
+        self.index = ChainIndex.from_chain(self.chain)
+        # Pending transactions are sharded by contract name, the sequence orders them globally for blocks
+        self.shards: Dict[str, ContractShard] = {}
+        self.shards_lock = Lock()
+        self.sequence = itertools.count()
         self.contracts: Dict[str, VotingSmartContract] = {}
         self.lock = Lock()
+        self.wal: WriteAheadLog = None
+        # Called without the lock held after a block joined the block tree
+        self.on_block_added = None
+        self.max_pending = max_pending
+        self.eviction_policy = eviction_policy
+        # Bumped after every change of pending transactions or contract state, read endpoints cache against it
+        self.versions = itertools.count(1)
+        self.version = 0
+        self.tracer = TransactionTracer(trace_capacity)
+        self.template_builder = BlockTemplateBuilder(max_block_transactions, max_block_bytes)
 
     def create_genesis_block(self) -> Block:
         return Block([], "0", 0)
 
     def add_block(self, block: Block, validator: Validator) -> bool:
         if block in validator.validated_blocks:
-            if self.is_valid_block(block, self.last_block):
-                self.lock.acquire()
-                try:
-                    if self.is_valid_block(block, self.last_block):  # Check again after acquiring lock
-                        self.chain.append(block)
-                        return True
-                finally:
-                    self.lock.release()
+            return self.add_existing_block(block)
         return False
 
     def add_transaction(self, transaction: Transaction, private_key=None):
         if private_key is not None:
             transaction.sign(private_key)
-        if self.is_valid_transaction(transaction):
-            if transaction not in self.pending_transactions:
-                self.pending_transactions.append(transaction)
-            if self.need_new_block():
-                return True, Status.NEW_BLOCK
-            return True, Status.NEW_TRANSACTION
-        return False, Status.IGNORED
-
-    def need_new_block(self) -> bool:
-        if len(self.pending_transactions) >= 5:
+        # Only a CREATE may open a shard for an unknown contract, anything else for it is invalid anyway
+        if transaction.contract_method == ContractMethods.CREATE:
+            shard = self.get_or_create_shard(transaction.contract_name)
+        else:
+            shard = self.shards.get(transaction.contract_name)
+        if shard is None:
+            return False, Status.IGNORED
+        with shard.lock:
+            if not self.is_valid_transaction(transaction):
+                return False, Status.IGNORED
+            if transaction not in shard:
+                if self.is_pending_pool_full() and not self.evict_oldest_vote(shard):
+                    return False, Status.MEMPOOL_FULL
+                shard.add(transaction, next(self.sequence))
+        self.tracer.record(transaction.get_id(), TraceStages.ADMITTED)
+        self.bump_version()
+        # Logged before the caller acknowledges the transaction
+        if self.wal is not None:
+            self.wal.append(RecordTypes.TRANSACTION, transaction.to_dict())
+        if self.need_new_block():
+            return True, Status.NEW_BLOCK
+        return True, Status.NEW_TRANSACTION
+
+    def bump_version(self):
+        self.version = next(self.versions)
+
+    def is_pending_pool_full(self) -> bool:
+        return self.max_pending is not None and self.pending_count >= self.max_pending
+
+    def evict_oldest_vote(self, locked_shard: ContractShard) -> bool:
+        if self.eviction_policy != EvictionPolicy.EVICT_OLDEST:
+            return False
+        candidates = []
+        for shard in list(self.shards.values()):
+            oldest = shard.get_oldest_vote()
+            if oldest is not None:
+                candidates.append((oldest[0], shard))
+        for _, shard in sorted(candidates, key=lambda candidate: candidate[0]):
+            # The caller holds locked_shard, other shards are only tried without blocking to avoid lock cycles
+            if shard is not locked_shard and not shard.lock.acquire(blocking=False):
+                continue
+            try:
+                oldest = shard.get_oldest_vote()
+                if oldest is not None and shard.remove(oldest[1]):
+                    logging.info("Pending pool is full, evicted vote %s of %s", oldest[1].get_id(), shard.contract_name,
+                                 extra=SAMPLED)
+                    return True
+            finally:
+                if shard is not locked_shard:
+                    shard.lock.release()
+        return False
+
+    def get_or_create_shard(self, contract_name: str) -> ContractShard:
+        shard = self.shards.get(contract_name)
+        if shard is None:
+            with self.shards_lock:
+                shard = self.shards.setdefault(contract_name, ContractShard(contract_name))
+        return shard
+
+    def lock_shards(self, contract_names: Iterable[str]) -> ExitStack:
+        # Always in name order, so block application can't deadlock with another multi-shard holder
+        stack = ExitStack()
+        for contract_name in sorted(set(contract_names)):
+            stack.enter_context(self.get_or_create_shard(contract_name).lock)
+        return stack
+
+    def add_pending_transaction(self, tx: Transaction):
+        shard = self.get_or_create_shard(tx.contract_name)
+        if tx not in shard:
+            shard.add(tx, next(self.sequence))
+
+    def remove_pending_transaction(self, tx: Transaction) -> bool:
+        shard = self.shards.get(tx.contract_name)
+        return shard.remove(tx) if shard is not None else False
+
+    def is_pending(self, tx: Transaction) -> bool:
+        shard = self.shards.get(tx.contract_name)
+        return shard is not None and tx in shard
+
+    @property
+    def pending_transactions(self) -> List[Transaction]:
+        pending = []
+        for shard in list(self.shards.values()):
+            pending += shard.get_pending()
+        return [tx for _, tx in sorted(pending, key=lambda entry: entry[0])]
+
+    @property
+    def pending_count(self) -> int:
+        return sum(len(shard) for shard in list(self.shards.values()))
+
+    def need_new_block(self, in_flight: Iterable[str] = ()) -> bool:
+        # in_flight holds ids of transactions already proposed in a block that isn't committed yet
+        in_flight = set(in_flight)
+        pending_count = self.pending_count if not in_flight else \
+            sum(1 for tx in self.pending_transactions if tx.get_id() not in in_flight)
+        if pending_count >= 5:
             return True
         return False
 
     def get_new_block(self) -> Block:
-        return Block(self.pending_transactions, self.last_block.hash)
+        # Pending transactions left out by the size limits wait for the next block
+        return Block(self.template_builder.build(self.shards.values()), self.last_block.hash)
 
     @staticmethod
     def is_valid_block(block: Block, previous_block: Block) -> bool:
         if previous_block.hash != block.previous_hash:
             return False
+        return Blockchain.verify_block(block)
+
+    @staticmethod
+    def verify_block(block: Block) -> bool:
+        # Checks that don't depend on the parent, so they can run for many blocks in parallel
+        if block.calculate_merkle_root() != block.merkle_root:
+            return False
+        # An odd node of the Merkle tree is paired with itself, so [a, b, c] and [a, b, c, c] share the root and hash
+        tx_ids = [tx.get_id() for tx in block.transactions]
+        if len(set(tx_ids)) != len(tx_ids):
+            return False
 
         block_hash = block.calculate_hash()
 
         if block_hash != block.hash:
             return False
 
-        # Verify all transactions in the block
+        # Verify the signature of every transaction in the block
         for tx in block.transactions:
-            # Verify the signature of the transaction
-            public_key = tx.voter_key
-            message = f"{tx.voter_key.save_pkcs1().hex()}{tx.contract_name}{tx.contract_method}{tx.args}{tx.timestamp}".encode()
-            try:
-                rsa.verify(message, tx.signature, public_key)
-            except Exception as e:
-                logging.exception(e)
+            if not tx.verify():
+                logging.warning("Block %s has transaction %s with an invalid signature", block.hash, tx.get_id())
                 return False
         return True
 
-    def add_existing_block(self, block: Block):
-        if self.is_valid_block(block, self.last_block):
-            self.chain.append(block)
-            return True
-        return False
+    def add_existing_block(self, block: Block, verified: bool = False) -> bool:
+        # Returns True only when the block became part of the main chain. verified blocks already passed verify_block
+        with self.lock:
+            if block.hash in self.block_tree:
+                return False
+            parent = self.block_tree.get(block.previous_hash)
+            if parent is None or not (verified or self.is_valid_block(block, parent.block)):
+                return False
+            # Logged before it is stored, a block the log failed to sync for isn't kept either
+            if self.wal is not None:
+                self.wal.append(RecordTypes.BLOCK, block.to_dict())
+            node = self.block_tree.add(block)
+            on_main_chain = self.block_tree.is_better_tip(node)
+            if on_main_chain:
+                self.switch_tip(node)
+            else:
+                logging.info("Block %s stored on a side branch at height %s", block.hash, node.height)
+        if self.on_block_added is not None:
+            self.on_block_added(block)
+        return on_main_chain
+
+    def switch_tip(self, new_tip: BlockNode):
+        # Roll contract state back and forward only through the blocks that differ between the two branches
+        rollback, apply = self.block_tree.get_fork_path(new_tip)
+        contract_names = [tx.contract_name for node in rollback + apply for tx in node.block.transactions]
+        with self.lock_shards(contract_names):
+            returned_transactions = []
+            for node in rollback:
+                self.rollback_contracts(node.undo)
+                node.undo = []
+                self.chain.pop()
+                self.index.remove_block(node.block)
+                returned_transactions = node.block.transactions + returned_transactions
+            committed = set()
+            for node in apply:
+                self.chain.append(node.block)
+                tx_ids = [tx.get_id() for tx in node.block.transactions]
+                self.tracer.record_many(tx_ids, TraceStages.COMMITTED)
+                executed = self.execute_contracts(node.block)
+                node.undo = [entry for _, entry in executed]
+                self.index.add_block(node.block, node.height,
+                                     [position for position, entry in executed if entry[0] == ContractMethods.VOTE])
+                self.tracer.record_many(tx_ids, TraceStages.EXECUTED)
+                committed.update(tx_ids)
+            self.block_tree.tip = new_tip
+
+            # Contract state is updated before pending transactions are dropped, so admission never sees a transaction
+            # that is neither pending nor executed and accepts it again. Rolled back transactions are checked against
+            # the new state like new ones, e.g. a vote of a voter already counted on the winning branch is dropped
+            for tx in returned_transactions:
+                if tx.get_id() not in committed and self.is_valid_transaction(tx):
+                    self.add_pending_transaction(tx)
+            for node in apply:
+                for tx in node.block.transactions:
+                    self.remove_pending_transaction(tx)
+            self.bump_version()
+        if rollback:
+            logging.info("Reorganized to %s: rolled back %s, applied %s", new_tip.block.hash, len(rollback), len(apply))
+
+    def open_wal(self, path: str, mode: str):
+        # Replays blocks and accepted transactions from a previous run, then logs new ones to the same file
+        for record_type, data in WriteAheadLog.read(path):
+            if record_type == RecordTypes.BLOCK:
+                self.add_existing_block(Block.from_dict(data))
+            elif record_type == RecordTypes.TRANSACTION:
+                self.add_transaction(Transaction.from_dict(data))
+        logging.info("Replayed %s: height %s, %s pending transactions", path, len(self.chain) - 1, self.pending_count)
+        self.wal = WriteAheadLog(path, mode)
 
     def add_existing_contract(self, contract: VotingSmartContract):
         self.contracts[contract.name] = contract
+        self.bump_version()
 
-    def execute_contracts(self):
-        for tx in self.last_block.transactions:
-            if tx.contract_method == ContractMethods.CREATE:
-                contract = VotingSmartContract(tx.contract_name)
-                if contract in self.contracts:
-                    logging.debug(f"Contract {contract} already exists")
+    def execute_contracts(self, block: Block = None) -> list:
+        # Returns the inverse operations needed to roll the block back, each with the position of its transaction
+        block = self.last_block if block is None else block
+        executed = self.execute_batched_at_positions(block)
+        self.bump_version()
+        return executed
+
+    def execute_sequentially(self, block: Block) -> list:
+        undo = []
+        for tx in block.transactions:
+            undo += self.execute_transaction(tx)
+        return undo
+
+    def execute_batched(self, block: Block) -> list:
+        return [entry for _, entry in self.execute_batched_at_positions(block)]
+
+    def execute_batched_at_positions(self, block: Block) -> list:
+        # Contracts don't affect each other, so each one runs its transactions on its own. Runs of consecutive votes
+        # between lifecycle transactions are applied in bulk, undo entries are put back into block order
+        contract_transactions: Dict[str, list] = {}
+        for position, tx in enumerate(block.transactions):
+            contract_transactions.setdefault(tx.contract_name, []).append((position, tx))
+        undo = []
+        for contract_name, transactions in contract_transactions.items():
+            votes = []
+            for position, tx in transactions:
+                if tx.contract_method == ContractMethods.VOTE:
+                    votes.append((position, tx))
                     continue
-                self.contracts[contract.name] = contract
-                logging.debug(f"Contract {contract} added to blockchain during block creation")
-            current_contract = self.get_contract_by_name(tx.contract_name)
-            if current_contract is not None:
-                try:
-                    if tx.contract_method == ContractMethods.START_VOTING:
-                        current_contract.start_voting()
-                        logging.debug(f"Contract {current_contract.name} started during block creation")
-                    if tx.contract_method == ContractMethods.ADD_CANDIDATE:
-                        current_contract.add_candidate(*tx.args)
-                        logging.debug(
-                            f"Candidate {tx.args} added to contract {current_contract.name} during block creation")
-                    if tx.contract_method == ContractMethods.VOTE:
-                        current_contract.vote(*tx.args)
-                        logging.debug(f"Vote added to contract {current_contract.name} during block creation")
-                    if tx.contract_method == ContractMethods.FINISH_VOTING:
-                        current_contract.finish_voting()
-                        logging.debug(f"Contract {current_contract.name} finished during block creation")
-                except Exception as e:
-                    logging.exception(e)
+                undo += self.execute_votes(contract_name, votes)
+                votes = []
+                undo += [(position, entry) for entry in self.execute_transaction(tx)]
+            undo += self.execute_votes(contract_name, votes)
+        undo.sort(key=lambda item: item[0])
+        # Contracts created by the block are listed in the order of their CREATE, as if run one by one
+        for _, entry in undo:
+            if entry[0] == ContractMethods.CREATE:
+                self.contracts[entry[1]] = self.contracts.pop(entry[1])
+        return undo
+
+    def execute_votes(self, contract_name: str, votes: list) -> list:
+        contract = self.get_contract_by_name(contract_name)
+        if contract is None or not votes:
+            return []
+        positions, ballots = [], []
+        for position, tx in votes:
+            try:
+                voter_key, candidate = tx.args
+            except (TypeError, ValueError):
+                # Fails the same way in VotingSmartContract.vote(*tx.args) on the sequential path
+                continue
+            positions.append(position)
+            ballots.append((voter_key, candidate))
+        accepted = contract.vote_batch(ballots)
+        if len(accepted) < len(votes):
+            logging.warning("%s of %s votes for %s rejected", len(votes) - len(accepted), len(votes), contract_name,
+                            extra=SAMPLED)
+        logging.debug("%s votes added to contract %s during block creation", len(accepted), contract_name)
+        return [(positions[i], (ContractMethods.VOTE, contract_name, ballots[i][0])) for i in accepted]
+
+    def execute_transaction(self, tx: Transaction) -> list:
+        undo = []
+        if tx.contract_method == ContractMethods.CREATE:
+            if tx.contract_name in self.contracts:
+                logging.debug("Contract %s already exists", tx.contract_name)
+                return undo
+            self.contracts[tx.contract_name] = VotingSmartContract(tx.contract_name)
+            undo.append((ContractMethods.CREATE, tx.contract_name))
+            logging.debug("Contract %s added to blockchain during block creation", tx.contract_name)
+        current_contract = self.get_contract_by_name(tx.contract_name)
+        if current_contract is not None:
+            try:
+                if tx.contract_method == ContractMethods.START_VOTING:
+                    previous_state = current_contract.state
+                    current_contract.start_voting()
+                    undo.append((ContractMethods.START_VOTING, tx.contract_name, previous_state))
+                    logging.debug("Contract %s started during block creation", current_contract.name)
+                if tx.contract_method == ContractMethods.ADD_CANDIDATE:
+                    current_contract.add_candidate(*tx.args)
+                    undo.append((ContractMethods.ADD_CANDIDATE, tx.contract_name, tx.args[0]))
+                    logging.debug("Candidate %s added to contract %s during block creation", tx.args,
+                                  current_contract.name)
+                if tx.contract_method == ContractMethods.VOTE:
+                    current_contract.vote(*tx.args)
+                    undo.append((ContractMethods.VOTE, tx.contract_name, tx.args[0]))
+                    logging.debug("Vote added to contract %s during block creation", current_contract.name)
+                if tx.contract_method == ContractMethods.FINISH_VOTING:
+                    previous_state = current_contract.state
+                    current_contract.finish_voting()
+                    undo.append((ContractMethods.FINISH_VOTING, tx.contract_name, previous_state))
+                    logging.debug("Contract %s finished during block creation", current_contract.name)
+            except Exception as e:
+                logging.exception(e)
+        return undo
+
+    def rollback_contracts(self, undo: list):
+        for contract_method, contract_name, *data in reversed(undo):
+            if contract_method == ContractMethods.CREATE:
+                del self.contracts[contract_name]
+                continue
+            contract = self.contracts[contract_name]
+            if contract_method in (ContractMethods.START_VOTING, ContractMethods.FINISH_VOTING):
+                contract.set_state(data[0])
+            elif contract_method == ContractMethods.ADD_CANDIDATE:
+                contract.remove_candidate(data[0])
+            elif contract_method == ContractMethods.VOTE:
+                contract.remove_vote(data[0])
+        self.bump_version()
+
+    def get_block_by_hash(self, block_hash: str):
+        height = self.index.get_block_height(block_hash)
+        return self.chain[height] if height is not None else None
+
+    def get_block_by_height(self, height: int):
+        return self.chain[height] if 0 <= height < len(self.chain) else None
+
+    def get_transaction_location(self, tx_id: str):
+        location = self.index.get_transaction_location(tx_id)
+        if location is None:
+            return None
+        height, position = location
+        block = self.chain[height]
+        return {
+            "transaction": block.transactions[position].to_dict(),
+            "block_hash": block.hash,
+            "height": height,
+            "position": position,
+        }
+
+    def get_vote_location(self, contract_name: str, fingerprint: str):
+        tx_id = self.index.get_vote_transaction_id(contract_name, fingerprint)
+        return self.get_transaction_location(tx_id) if tx_id is not None else None
+
+    def get_transaction_proof(self, tx_id: str):
+        location = self.index.get_transaction_location(tx_id)
+        if location is None:
+            return None
+        height, position = location
+        block = self.chain[height]
+        return {
+            "transaction_id": tx_id,
+            "block_hash": block.hash,
+            "merkle_root": block.merkle_root,
+            "index": position,
+            "proof": block.get_merkle_tree().get_proof(position),
+        }
 
     def get_contract_by_name(self, contract_name) -> VotingSmartContract:
         return self.contracts.get(contract_name)
@@ -142,7 +435,10 @@ class Blockchain:
     def from_dict(cls, dict_):
         obj = cls()
         obj.chain = [Block.from_dict(block) for block in dict_["chain"]]
-        obj.pending_transactions = [Transaction.from_dict(tx) for tx in dict_["pending_transactions"]]
+        obj.block_tree = BlockTree.from_chain(obj.chain)
+        obj.index = ChainIndex.from_chain(obj.chain)
+        for tx in dict_["pending_transactions"]:
+            obj.add_pending_transaction(Transaction.from_dict(tx))
         contracts_dict = dict_["contracts"]
         obj.contracts = {name: VotingSmartContract.from_dict(contracts_dict[name]) for name in contracts_dict}
         return obj
@@ -150,7 +446,10 @@ class Blockchain:
     def copy(self):
         new_chain = Blockchain()
         new_chain.chain = self.chain.copy()
-        new_chain.pending_transactions = self.pending_transactions.copy()
+        new_chain.block_tree = BlockTree.from_chain(new_chain.chain)
+        new_chain.index = ChainIndex.from_chain(new_chain.chain)
+        for tx in self.pending_transactions:
+            new_chain.add_pending_transaction(tx)
         return new_chain
 
     @property
@@ -181,59 +480,62 @@ class Blockchain:
             logging.exception(e)
             return False
 
+    def get_pending_shard(self, contract_name) -> ContractShard:
+        # Contracts without pending transactions share one empty, never mutated shard
+        return self.shards.get(contract_name) or EMPTY_SHARD
+
     def is_contract_exist(self, contract_name):
-        pending_contracts = [tx.contract_name for tx in self.pending_transactions if
-                             tx.contract_method == ContractMethods.CREATE]
-        if contract_name in pending_contracts or contract_name in self.contracts:
-            logging.debug(f"Contract {contract_name} exists")
+        if self.get_pending_shard(contract_name).has_pending_method(ContractMethods.CREATE) or \
+                contract_name in self.contracts:
+            logging.debug("Contract %s exists", contract_name)
             return True
-        logging.debug(f"Contract {contract_name} does not exist")
+        logging.debug("Contract %s does not exist", contract_name)
         return False
 
     def is_contract_started(self, contract_name):
-        started_pending_contracts = [tx.contract_name for tx in self.pending_transactions if
-                                     tx.contract_method == ContractMethods.START_VOTING]
+        started_pending = self.get_pending_shard(contract_name).has_pending_method(ContractMethods.START_VOTING)
         contract = self.get_contract_by_name(contract_name)
-        if contract_name in started_pending_contracts or (contract.is_voting_in_progress() if contract else False):
-            logging.debug(f"Contract {contract_name} is already started")
+        if started_pending or (contract.is_voting_in_progress() if contract else False):
+            logging.debug("Contract %s is already started", contract_name)
             return True
-        logging.debug(f"Contract {contract_name} is not started")
+        logging.debug("Contract %s is not started", contract_name)
         return False
 
     def is_candidate_exist(self, contract_name, candidate):
-        pending_candidates = [tx.args[0] for tx in self.pending_transactions if
-                              tx.contract_method == ContractMethods.ADD_CANDIDATE and tx.contract_name == contract_name]
+        pending_candidate = self.get_pending_shard(contract_name).has_pending_candidate(candidate)
         contract = self.get_contract_by_name(contract_name)
-        if candidate in pending_candidates or (contract.is_candidate_exist(candidate) if contract else False):
-            logging.debug(f"Candidate {candidate} is already exist for {contract_name}")
+        if pending_candidate or (contract.is_candidate_exist(candidate) if contract else False):
+            logging.debug("Candidate %s is already exist for %s", candidate, contract_name)
             return True
-        logging.debug(f"Candidate {candidate} does not exist for {contract_name}")
+        logging.debug("Candidate %s does not exist for %s", candidate, contract_name)
         return False
 
     def is_voter_voted_already(self, voter_key, contract_name):
-        pending_votes = [tx.voter_key for tx in self.pending_transactions if
-                         tx.contract_method == ContractMethods.VOTE and tx.contract_name == contract_name]
+        pending_vote = self.get_pending_shard(contract_name).has_pending_voter(voter_key)
         contract = self.get_contract_by_name(contract_name)
-        if voter_key in pending_votes or (contract.is_voter_key_exist(voter_key) if contract else False):
-            logging.debug(f"Voter {voter_key} is already voted for {contract_name}")
+        if pending_vote or (contract.is_voter_key_exist(voter_key) if contract else False):
+            logging.debug("Voter %s is already voted for %s", voter_key, contract_name)
             return True
-        logging.debug(f"Voter {voter_key} did not vote yet for {contract_name}")
+        logging.debug("Voter %s did not vote yet for %s", voter_key, contract_name)
         return False
 
     def is_contract_finished(self, contract_name):
-        finished_pending_contracts = [tx.contract_name for tx in self.pending_transactions if
-                                      tx.contract_method == ContractMethods.FINISH_VOTING]
+        finished_pending = self.get_pending_shard(contract_name).has_pending_method(ContractMethods.FINISH_VOTING)
         contract = self.get_contract_by_name(contract_name)
-        if contract_name in finished_pending_contracts or (contract.is_voting_in_finished() if contract else False):
-            logging.debug(f"Contract {contract_name} is already finished")
+        if finished_pending or (contract.is_voting_in_finished() if contract else False):
+            logging.debug("Contract %s is already finished", contract_name)
             return True
-        logging.debug(f"Contract {contract_name} is not finished yet")
+        logging.debug("Contract %s is not finished yet", contract_name)
         return False
 
     def get_candidates_for_contract(self, contract_name):
-        pending_candidates = [tx.args[0] for tx in self.pending_transactions if
-                              tx.contract_method == ContractMethods.ADD_CANDIDATE and tx.contract_name == contract_name]
+        pending_candidates = list(self.get_pending_shard(contract_name).candidates)
         contract = self.get_contract_by_name(contract_name)
         if contract is not None:
             pending_candidates += contract.candidates.keys()
         return pending_candidates
+
+    def get_contract_names(self):
+        pending_contracts = [name for name, shard in list(self.shards.items()) if
+                             shard.has_pending_method(ContractMethods.CREATE)]
+        return pending_contracts + list(self.contracts)
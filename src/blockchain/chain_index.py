@@ -0,0 +1,51 @@
+from typing import Dict, List
+
+from src.blockchain.block import Block
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import get_key_fingerprint
+
+
+class ChainIndex:
+    def __init__(self):
+        self.block_heights: Dict[str, int] = {}
+        # transaction id -> [height, position in block]
+        self.transactions: Dict[str, List[int]] = {}
+        # contract name -> voter key fingerprint -> vote transaction id
+        self.votes: Dict[str, Dict[str, str]] = {}
+
+    def add_block(self, block: Block, height: int, accepted_votes: List[int] = ()):
+        # accepted_votes are the positions of the block's votes its contracts counted, rejected votes aren't indexed
+        # so they can't replace the vote a voter is counted with
+        self.block_heights[block.hash] = height
+        for position, tx in enumerate(block.transactions):
+            self.transactions[tx.get_id()] = [height, position]
+        for position in accepted_votes:
+            tx = block.transactions[position]
+            self.votes.setdefault(tx.contract_name, {})[get_key_fingerprint(tx.voter_key)] = tx.get_id()
+
+    def remove_block(self, block: Block):
+        self.block_heights.pop(block.hash, None)
+        for tx in block.transactions:
+            self.transactions.pop(tx.get_id(), None)
+            if tx.contract_method == ContractMethods.VOTE:
+                votes = self.votes.get(tx.contract_name, {})
+                fingerprint = get_key_fingerprint(tx.voter_key)
+                if votes.get(fingerprint) == tx.get_id():
+                    del votes[fingerprint]
+
+    def get_block_height(self, block_hash: str):
+        return self.block_heights.get(block_hash)
+
+    def get_transaction_location(self, tx_id: str):
+        return self.transactions.get(tx_id)
+
+    def get_vote_transaction_id(self, contract_name: str, fingerprint: str):
+        return self.votes.get(contract_name, {}).get(fingerprint)
+
+    @classmethod
+    def from_chain(cls, chain: List[Block]):
+        # Without executing the chain it isn't known which votes were counted, votes are indexed by switch_tip
+        obj = cls()
+        for height, block in enumerate(chain):
+            obj.add_block(block, height)
+        return obj
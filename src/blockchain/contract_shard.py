@@ -0,0 +1,67 @@
+from collections import Counter
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import Transaction
+
+
+class ContractShard:
+    # Pending transactions of one contract with indexes used by admission checks, guarded by its own lock
+    def __init__(self, contract_name: str):
+        self.contract_name = contract_name
+        self.lock = Lock()
+        # transaction id -> (global sequence number, transaction)
+        self.pending: Dict[str, Tuple[int, Transaction]] = {}
+        self.methods = Counter()
+        self.candidates = Counter()
+        self.voters = Counter()
+
+    def __contains__(self, tx: Transaction) -> bool:
+        return tx.get_id() in self.pending
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, tx: Transaction, sequence: int):
+        self.pending[tx.get_id()] = (sequence, tx)
+        self.methods[tx.contract_method] += 1
+        if tx.contract_method == ContractMethods.ADD_CANDIDATE:
+            self.candidates[tx.args[0]] += 1
+        if tx.contract_method == ContractMethods.VOTE:
+            self.voters[tx.voter_key] += 1
+
+    def remove(self, tx: Transaction) -> bool:
+        if self.pending.pop(tx.get_id(), None) is None:
+            return False
+        self.decrement(self.methods, tx.contract_method)
+        if tx.contract_method == ContractMethods.ADD_CANDIDATE:
+            self.decrement(self.candidates, tx.args[0])
+        if tx.contract_method == ContractMethods.VOTE:
+            self.decrement(self.voters, tx.voter_key)
+        return True
+
+    @staticmethod
+    def decrement(counter: Counter, key):
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def has_pending_method(self, contract_method: str) -> bool:
+        return self.methods[contract_method] > 0
+
+    def has_pending_candidate(self, candidate: str) -> bool:
+        return candidate in self.candidates
+
+    def has_pending_voter(self, voter_key) -> bool:
+        return voter_key in self.voters
+
+    def get_oldest_vote(self) -> Tuple[int, Transaction]:
+        # Pending transactions are kept in arrival order
+        for sequence, tx in self.pending.values():
+            if tx.contract_method == ContractMethods.VOTE:
+                return sequence, tx
+        return None
+
+    def get_pending(self) -> List[Tuple[int, Transaction]]:
+        return list(self.pending.values())
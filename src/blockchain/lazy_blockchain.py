@@ -0,0 +1,27 @@
+from typing import List
+
+from src.blockchain.transaction import Transaction
+
+
+class LazyBlockchain:
+    # Remote chain from a BLOCKCHAIN message. Only header fields are read up front,
+    # blocks and transactions are decoded when asked for
+    def __init__(self, dict_):
+        self.block_dicts = dict_["chain"]
+        self.pending_dicts = dict_["pending_transactions"]
+
+    def __len__(self):
+        return len(self.block_dicts)
+
+    def get_hash(self, height: int) -> str:
+        return self.block_dicts[height]["hash"]
+
+    def get_block_dicts_after(self, known_hashes) -> List[dict]:
+        # Walks back from the remote tip to the newest block we already know, only what follows needs decoding
+        height = len(self.block_dicts) - 1
+        while height >= 0 and self.get_hash(height) not in known_hashes:
+            height -= 1
+        return self.block_dicts[height + 1:]
+
+    def get_pending_transactions(self, known_signatures=()) -> List[Transaction]:
+        return [Transaction.from_dict(tx) for tx in self.pending_dicts if tx["signature"] not in known_signatures]
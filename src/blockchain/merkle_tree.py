@@ -0,0 +1,43 @@
+from hashlib import sha256
+from typing import List
+
+EMPTY_ROOT = sha256(b'').hexdigest()
+
+
+def hash_pair(left: str, right: str) -> str:
+    return sha256((left + right).encode()).hexdigest()
+
+
+class MerkleTree:
+    def __init__(self, leaves: List[str]):
+        # levels[0] holds the transaction ids, levels[-1] the root. An odd node is paired with itself
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            if len(level) % 2:
+                level = level + [level[-1]]
+            self.levels.append([hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)])
+
+    @property
+    def root(self) -> str:
+        return self.levels[-1][0] if self.levels[0] else EMPTY_ROOT
+
+    def get_proof(self, index: int) -> List[dict]:
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling >= len(level):
+                sibling = index
+            proof.append({'hash': level[sibling], 'position': 'left' if sibling < index else 'right'})
+            index //= 2
+        return proof
+
+    @staticmethod
+    def verify_proof(leaf: str, proof: List[dict], root: str) -> bool:
+        current = leaf
+        for step in proof:
+            if step['position'] == 'left':
+                current = hash_pair(step['hash'], current)
+            else:
+                current = hash_pair(current, step['hash'])
+        return current == root
@@ -1,4 +1,6 @@
 import json
+from collections import Counter
+from typing import List, Tuple
 
 import rsa
 from rsa import PublicKey
@@ -46,6 +48,31 @@ class VotingSmartContract:
         self.votes[voter_key] = candidate
         self.candidates[candidate] += 1
 
+    def vote_batch(self, ballots: List[Tuple[PublicKey, str]]) -> List[int]:
+        # Same checks and order as vote for every (voter_key, candidate), candidate counters are then updated from
+        # one aggregation over the accepted ballots. Returns the indices of accepted ballots
+        if self.state == State.NOT_STARTED or self.is_voting_in_finished():
+            return []
+        accepted = []
+        for i, (voter_key, candidate) in enumerate(ballots):
+            try:
+                if candidate not in self.candidates or voter_key in self.votes:
+                    continue
+            except TypeError:
+                continue
+            self.votes[voter_key] = candidate
+            accepted.append(i)
+        for candidate, count in Counter(ballots[i][1] for i in accepted).items():
+            self.candidates[candidate] += count
+        return accepted
+
+    def remove_candidate(self, candidate: str):
+        del self.candidates[candidate]
+
+    def remove_vote(self, voter_key: PublicKey):
+        candidate = self.votes.pop(voter_key)
+        self.candidates[candidate] -= 1
+
     def get_results(self):
         if not self.is_voting_in_finished():
             raise Exception("Voting is not finished yet")
@@ -62,6 +89,9 @@ class VotingSmartContract:
     def finish_voting(self):
         self.state = State.FINISHED
 
+    def set_state(self, state: str):
+        self.state = state
+
     def to_dict(self):
         return {
             "name": self.name,
@@ -2,3 +2,4 @@ class Status:
     NEW_TRANSACTION = "new_transaction"
     NEW_BLOCK = "new_block"
     IGNORED = "ignored"
+    MEMPOOL_FULL = "mempool_full"
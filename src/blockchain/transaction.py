@@ -1,4 +1,5 @@
 import time
+from hashlib import sha256
 
 import rsa
 from rsa import PublicKey, PrivateKey
@@ -6,6 +7,10 @@ from rsa import PublicKey, PrivateKey
 from src.blockchain.contract_methods import ContractMethods
 
 
+def get_key_fingerprint(public_key: PublicKey) -> str:
+    return sha256(public_key.save_pkcs1()).hexdigest()
+
+
 class Transaction:
     def __init__(self, voter_key: PublicKey, contract_name: str, contract_method: str, args=None,
                  timestamp: float = None,
@@ -16,10 +21,32 @@ class Transaction:
         self.args = args
         self.timestamp = time.time() if timestamp is None else timestamp
         self.signature = signature
+        self.id = None
 
     def sign(self, private_key: PrivateKey):
-        message = f"{self.voter_key.save_pkcs1().hex()}{self.contract_name}{self.contract_method}{self.args}{self.timestamp}".encode()
-        self.signature = rsa.sign(message, private_key, 'SHA-256')
+        self.set_signature(rsa.sign(self.get_message(), private_key, 'SHA-256'))
+
+    def set_signature(self, signature: bytes):
+        self.signature = signature
+        self.id = None
+
+    def verify(self) -> bool:
+        if self.signature is None:
+            return False
+        try:
+            rsa.verify(self.get_message(), self.signature, self.voter_key)
+        except rsa.VerificationError:
+            return False
+        return True
+
+    def get_id(self) -> str:
+        # Digest is computed once per signature, blocks hash the Merkle root over these ids
+        if self.id is None:
+            self.id = sha256(self.get_message() + (self.signature or b'')).hexdigest()
+        return self.id
+
+    def get_message(self) -> bytes:
+        return f"{self.voter_key.save_pkcs1().hex()}{self.contract_name}{self.contract_method}{self.args}{self.timestamp}".encode()
 
     def to_dict(self):
         if self.contract_method == ContractMethods.VOTE:
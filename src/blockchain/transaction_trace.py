@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List
+
+PERCENTILES = [50, 90, 99]
+
+
+class TraceStages:
+    RECEIVED = "received"  # API request carrying or creating the transaction arrived
+    SIGNED = "signed"  # signed with the node key, transactions signed by clients skip it
+    ADMITTED = "admitted"  # added to the pending pool
+    BROADCAST = "broadcast"  # first sent to peers
+    PROPOSED = "proposed"  # part of a block this node proposed to the validators
+    VALIDATED = "validated"  # wait timer of the local validator fired for a block holding it
+    COMMITTED = "committed"  # block holding it became part of the main chain
+    EXECUTED = "executed"  # contract state updated
+    ORDER = [RECEIVED, SIGNED, ADMITTED, BROADCAST, PROPOSED, VALIDATED, COMMITTED, EXECUTED]
+
+
+class TransactionTracer:
+    # First timestamp of every stage per transaction id, the oldest traces are dropped beyond capacity
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self.traces: Dict[str, Dict[str, float]] = OrderedDict()
+        self.lock = Lock()
+
+    def record(self, tx_id: str, stage: str, timestamp: float = None):
+        self.record_many([tx_id], stage, timestamp)
+
+    def record_many(self, tx_ids: Iterable[str], stage: str, timestamp: float = None):
+        if not self.capacity:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for tx_id in tx_ids:
+                trace = self.traces.get(tx_id)
+                if trace is None:
+                    trace = self.traces[tx_id] = {}
+                    if len(self.traces) > self.capacity:
+                        self.traces.popitem(last=False)
+                trace.setdefault(stage, timestamp)
+
+    def get(self, tx_id: str) -> dict:
+        with self.lock:
+            trace = self.traces.get(tx_id)
+            trace = dict(trace) if trace is not None else None
+        if trace is None:
+            return None
+        return {"transaction_id": tx_id, "stages": trace, "durations": get_durations(trace)}
+
+    def get_stage_percentiles(self) -> dict:
+        with self.lock:
+            traces = [dict(trace) for trace in self.traces.values()]
+        durations = {stage: [] for stage in TraceStages.ORDER}
+        for trace in traces:
+            for stage, duration in get_durations(trace).items():
+                durations[stage].append(duration)
+        return {
+            "traces": len(traces),
+            "stages": {stage: {"count": len(values), **percentiles(values)}
+                       for stage, values in durations.items() if values},
+        }
+
+
+def get_durations(trace: Dict[str, float]) -> Dict[str, float]:
+    # Seconds from the latest earlier stage that had already happened, stages don't always come in ORDER
+    # (a block may be proposed before the transaction is broadcast)
+    durations = {}
+    for i, stage in enumerate(TraceStages.ORDER):
+        if stage not in trace:
+            continue
+        earlier = [trace[s] for s in TraceStages.ORDER[:i] if s in trace and trace[s] <= trace[stage]]
+        if earlier:
+            durations[stage] = trace[stage] - max(earlier)
+    return durations
+
+
+def percentiles(values: List[float]) -> dict:
+    ordered = sorted(values)
+    result = {f"p{p}": ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] for p in PERCENTILES}
+    result["max"] = ordered[-1]
+    return result
@@ -0,0 +1,60 @@
+import json
+import struct
+from typing import BinaryIO, Iterator, List
+
+from rsa import PublicKey
+
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import Transaction
+
+MAGIC = b"VOTES1\n"
+HEADER_LENGTH = struct.Struct("<I")
+# timestamp, candidate index, then the voter key modulus and the signature, key_bytes each
+RECORD_PREFIX = struct.Struct("<dH")
+PUBLIC_EXPONENT = 65537
+
+
+class VoteFileWriter:
+    # Signed votes of one contract, about 140 bytes per vote with 512 bit keys instead of ~600 as JSON
+    def __init__(self, file: BinaryIO, contract_name: str, candidates: List[str], key_bytes: int):
+        self.file = file
+        self.candidates = {candidate: index for index, candidate in enumerate(candidates)}
+        self.key_bytes = key_bytes
+        header = json.dumps({"contract": contract_name, "candidates": candidates, "key_bytes": key_bytes}).encode()
+        file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+    def write(self, tx: Transaction):
+        self.file.write(encode_vote(tx, self.candidates, self.key_bytes))
+
+    def write_encoded(self, records: bytes):
+        self.file.write(records)
+
+
+def encode_vote(tx: Transaction, candidates: dict, key_bytes: int) -> bytes:
+    if tx.voter_key.e != PUBLIC_EXPONENT:
+        raise ValueError(f"Only voter keys with public exponent {PUBLIC_EXPONENT} can be stored")
+    return RECORD_PREFIX.pack(tx.timestamp, candidates[tx.args[1]]) + \
+        tx.voter_key.n.to_bytes(key_bytes, "big") + tx.signature.rjust(key_bytes, b"\0")
+
+
+def read_header(file: BinaryIO) -> dict:
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a vote file")
+    length, = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+    return json.loads(file.read(length))
+
+
+def read_votes(file: BinaryIO) -> Iterator[Transaction]:
+    header = read_header(file)
+    contract_name, candidates, key_bytes = header["contract"], header["candidates"], header["key_bytes"]
+    record_size = RECORD_PREFIX.size + 2 * key_bytes
+    while True:
+        record = file.read(record_size)
+        if len(record) < record_size:
+            return
+        timestamp, candidate = RECORD_PREFIX.unpack_from(record)
+        offset = RECORD_PREFIX.size
+        voter_key = PublicKey(int.from_bytes(record[offset:offset + key_bytes], "big"), PUBLIC_EXPONENT)
+        signature = record[offset + key_bytes:]
+        yield Transaction(voter_key, contract_name, ContractMethods.VOTE, [voter_key, candidates[candidate]],
+                          timestamp, signature)
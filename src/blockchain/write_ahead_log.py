@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import threading
+from threading import Condition
+
+
+class DurabilityMode:
+    REQUEST = "request"  # fsync before every append returns
+    BATCHED = "batched"  # group commit, appends wait for one fsync shared with concurrent appends
+    OFF = "off"  # written to the OS without fsync
+
+
+class RecordTypes:
+    TRANSACTION = "transaction"
+    BLOCK = "block"
+
+
+class WriteAheadLogError(OSError):
+    pass
+
+
+class WriteAheadLog:
+    def __init__(self, path: str, mode: str = DurabilityMode.BATCHED):
+        self.path = path
+        self.mode = mode
+        # Appended records would otherwise continue a torn last line and be unreadable on the next replay
+        self.truncate_incomplete(path)
+        self.file = open(path, "a")
+        self.condition = Condition()
+        self.written = 0
+        self.synced = 0
+        # Set by a failed fsync. The kernel may have dropped the unsynced pages already and report later fsyncs as
+        # successful, so no append after it is acknowledged either
+        self.error: OSError = None
+        if mode == DurabilityMode.BATCHED:
+            threading.Thread(target=self.group_commit, daemon=True).start()
+
+    def append(self, record_type: str, data: dict):
+        line = json.dumps({"type": record_type, "data": data}) + "\n"
+        with self.condition:
+            self.raise_error()
+            self.file.write(line)
+            self.written += 1
+            position = self.written
+            if self.mode == DurabilityMode.OFF:
+                self.file.flush()
+                return
+            if self.mode == DurabilityMode.REQUEST:
+                self.file.flush()
+                try:
+                    os.fsync(self.file.fileno())
+                except OSError as e:
+                    self.error = e
+                    self.raise_error()
+                self.synced = position
+                return
+            self.condition.notify_all()
+            while self.synced < position:
+                self.raise_error()
+                self.condition.wait()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise WriteAheadLogError(f"Syncing {self.path} failed: {self.error}") from self.error
+
+    def group_commit(self):
+        while True:
+            with self.condition:
+                while self.synced == self.written:
+                    self.condition.wait()
+                target = self.written
+                self.file.flush()
+            # Appends keep going into the buffer while the disk syncs, they are covered by the next fsync
+            try:
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                logging.exception(e)
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.synced = target
+                self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+    @staticmethod
+    def read(path: str):
+        for record, _ in WriteAheadLog.read_complete(path):
+            yield record["type"], record["data"]
+
+    @staticmethod
+    def truncate_incomplete(path: str):
+        end = 0
+        for _, end in WriteAheadLog.read_complete(path):
+            pass
+        if os.path.exists(path) and os.path.getsize(path) > end:
+            logging.warning("Truncating %s to its last complete record at %s bytes", path, end)
+            with open(path, "r+b") as f:
+                f.truncate(end)
+
+    @staticmethod
+    def read_complete(path: str):
+        # Records with the offset their line ends at, up to a torn last line after a crash. A record is only
+        # acknowledged once its line including the newline is written, nothing after a torn line was
+        if not os.path.exists(path):
+            return
+        end = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    logging.warning("Skipping incomplete record in %s", path)
+                    return
+                end += len(line)
+                yield record, end
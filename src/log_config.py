@@ -0,0 +1,56 @@
+import atexit
+import itertools
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s"
+
+# Pass as extra= on per-message events (P2P messages, API calls) so they can be sampled
+SAMPLED = {"sampled": True}
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps every n-th sampled record, records without the sampled flag always pass
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / sample_rate)) if sample_rate > 0 else None
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        if self.every is None:
+            return False
+        return next(self.counter) % self.every == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    # QueueHandler.prepare formats the message in the calling thread, here formatting is left to the listener
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level: str = "INFO", sample_rate: float = 1.0, async_handler: bool = True):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level.upper())
+    # werkzeug raises its own logger to INFO unless a level is set, request lines follow the node level instead
+    logging.getLogger("werkzeug").setLevel(level.upper())
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if not async_handler:
+        stream_handler.addFilter(SamplingFilter(sample_rate))
+        root.addHandler(stream_handler)
+        return None
+
+    records = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    root.addHandler(queue_handler)
+    listener = QueueListener(records, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
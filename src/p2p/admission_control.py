@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class NodeBusyError(Exception):
+    pass
+
+
+class EvictionPolicy:
+    REJECT = "reject"  # new transactions are refused while the pending pool is full
+    EVICT_OLDEST = "evict_oldest"  # the oldest pending vote makes room, lifecycle transactions are never evicted
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            return True
+
+
+class RateLimiter:
+    # One token bucket per client, the least recently seen clients are forgotten past max_clients
+    def __init__(self, rate: float = None, burst: float = None, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+
+    def allow(self, client) -> bool:
+        if not self.rate:
+            return True
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+        return bucket.try_acquire()
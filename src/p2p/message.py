@@ -15,3 +15,4 @@ class MessageTypes:
     GENERATE_WAIT_TIME = "generate_wait_time"
     WAIT_TIME = "wait_time"
     ADD_ELAPSED_TIME = "add_elapsed_time"
+    HEARTBEAT = "heartbeat"
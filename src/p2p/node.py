@@ -1,133 +1,182 @@
+import itertools
 import logging
-from typing import List
+import threading
+import time
 
 from src.blockchain.block import Block
 from src.blockchain.blockchain import Blockchain
+from src.blockchain.lazy_blockchain import LazyBlockchain
 from src.blockchain.smart_contract import VotingSmartContract
 from src.blockchain.status import Status
 from src.blockchain.transaction import Transaction
+from src.blockchain.transaction_trace import TraceStages
 from src.p2p.peer import Peer
+from src.p2p.peer_table import PeerTable
+from src.p2p.sync_pipeline import SyncPipeline
 from src.p2p.validator import Validator
+from src.p2p.validator_registry import ValidatorRegistry
+from src.p2p.wait_time_scheduler import UniformScheduler, WaitTimeScheduler
 
 
 class Node:
-    def __init__(self, blockchain: Blockchain, peers: List[Peer], validators: List[Validator]):
+    def __init__(self, blockchain: Blockchain, peers: PeerTable, validators: ValidatorRegistry,
+                 sync_workers: int = 0, wait_time_scheduler: WaitTimeScheduler = None):
         self.blockchain = blockchain
+        self.wait_time_scheduler = wait_time_scheduler if wait_time_scheduler else UniformScheduler()
+        self.sync_pipeline = SyncPipeline(blockchain, sync_workers)
         self.peers = peers
         self.validators = validators
         self.local_validator: Validator = None
-
-    def add_peer(self, peer):
-        self.peers.append(peer)
-
-    def remove_peer(self, peer):
+        # Notified when a block joins the tree, the local validator's timer fires or wait times of a round change,
+        # threads waiting for round progress check again
+        self.round_progress = threading.Condition()
+        blockchain.on_block_added = self.notify_round_progress
+        # Bumped on changes of peers and validator wait times, read endpoints cache against it
+        self.versions = itertools.count(1)
+        self.version = 0
+
+    def bump_version(self):
+        self.version = next(self.versions)
+
+    def add_peer(self, peer: Peer):
+        if self.peers.add(peer):
+            self.bump_version()
+
+    def remove_peer(self, peer: Peer):
         self.peers.remove(peer)
+        self.bump_version()
 
     def add_transaction(self, transaction: Transaction):
-        if transaction not in self.blockchain.pending_transactions:
+        if not self.blockchain.is_pending(transaction):
             result, status = self.blockchain.add_transaction(transaction)
             if result and status == Status.NEW_BLOCK:
                 return True
         return False
 
     def add_block(self, block: Block):
-        if self.blockchain.is_valid_block(block, self.blockchain.chain[-1]):
-            if self.blockchain.add_existing_block(block):
-                self.blockchain.execute_contracts()
-                self.update_transactions(block)
-                return True
-        logging.info(f"Wasn't able to add block {block.to_dict()} to blockchain")
+        if self.blockchain.add_existing_block(block):
+            return True
+        logging.info("Wasn't able to add block %s to blockchain", block.hash)
         return False
 
-    def sync_blockchain(self, blockchain: Blockchain):
-        result = False
-        if len(blockchain.contracts) > len(self.blockchain.contracts):
-            self.blockchain.contracts = blockchain.contracts
-            result = True
-
-        if len(blockchain.chain) > len(self.blockchain.chain):
-            self.blockchain.chain = blockchain.chain
-            self.blockchain.pending_transactions = [tx for tx in self.blockchain.pending_transactions if
-                                                    tx not in blockchain.last_block.transactions]
-            self.blockchain.contracts = blockchain.contracts
-            result = True
-
-        if len(blockchain.chain) == len(self.blockchain.chain):
-            for tx in blockchain.pending_transactions:
-                if tx not in self.blockchain.pending_transactions:
-                    result, status = self.blockchain.add_transaction(tx)
-                    if result and status == Status.NEW_BLOCK:
-                        result = True
+    def sync_blockchain(self, blockchain: LazyBlockchain):
+        # Only blocks past the newest one we already know are decoded, verified and connected,
+        # fork choice picks the tip
+        result = self.sync_pipeline.sync(blockchain)
+
+        known_signatures = {tx.signature.hex() for tx in self.blockchain.pending_transactions if tx.signature}
+        for tx in blockchain.get_pending_transactions(known_signatures):
+            if not self.blockchain.is_pending(tx):
+                self.blockchain.add_transaction(tx)
+        self.blockchain.bump_version()
+        self.bump_version()
+        self.notify_round_progress()
         return result
 
-    def update_transactions(self, block):
-        for tx in block.transactions:
-            if tx in self.blockchain.pending_transactions:
-                self.blockchain.pending_transactions.remove(tx)
-
     def add_contract(self, contract: VotingSmartContract):
         if self.blockchain.get_contract_by_name(contract.name) is None:
             self.blockchain.add_existing_contract(contract)
             return True
         return False
 
-    def validate_block(self, block):
+    def validate_block(self, block, margin: float = None):
+        # With pipelined rounds the block may arrive before its parent, it is added once the parent is here. A block
+        # whose parent doesn't arrive is dropped margin seconds after the local wait timer for it fired
+        wait_time = self.local_validator.get_wait_time(block.previous_hash)
         self.local_validator.validate_block(block)
+        self.bump_version()
         if self.is_blockchain_has_block(block):
-            logging.info(f"Block {block.to_dict()} is already in blockchain")
-            self.stop_wait_timers()
+            logging.info("Block %s is already in blockchain", block.hash)
+            self.stop_wait_timers(block.previous_hash)
             return False
-        while not self.blockchain.add_block(block, self.local_validator):
-            if self.is_blockchain_has_block(block):
-                logging.info(f"Block {block.to_dict()} is already in blockchain")
-                self.stop_wait_timers()
-                return False
-        self.stop_wait_timers()
-        self.blockchain.execute_contracts()
-        self.update_transactions(block)
+        deadline = time.time() + (wait_time or 0) + margin if margin is not None else None
+        with self.round_progress:
+            while not self.blockchain.add_block(block, self.local_validator):
+                if self.is_blockchain_has_block(block):
+                    logging.info("Block %s is already in blockchain", block.hash)
+                    self.stop_wait_timers(block.previous_hash)
+                    return False
+                if not self.local_validator.is_validating(block):
+                    # Several nodes propose on the same parent, only the first of their blocks is timed. The round of
+                    # the others goes on, so their timers are left alone
+                    logging.info("Block %s is not validated, its round on %s has another block", block.hash,
+                                 block.previous_hash)
+                    return False
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    logging.warning("Dropping block %s, its round on %s timed out", block.hash, block.previous_hash)
+                    self.stop_wait_timers(block.previous_hash)
+                    return False
+                self.round_progress.wait(remaining)
+        self.stop_wait_timers(block.previous_hash)
         return True
 
+    def notify_round_progress(self, block: Block = None):
+        with self.round_progress:
+            self.round_progress.notify_all()
+
     def is_blockchain_has_block(self, block: Block):
-        return self.blockchain.last_block.hash == block.hash
+        return block.hash in self.blockchain.block_tree
 
     def register_validator(self, validator: Validator):
-        for v in self.validators:
-            if v.address == validator.address:
-                return False
+        if not self.validators.add(validator, local=True):
+            return False
         self.local_validator = validator
-        self.validators.append(validator)
+        validator.on_validated = self.on_validated
         return True
 
+    def on_validated(self, block: Block):
+        self.blockchain.tracer.record_many([tx.get_id() for tx in block.transactions], TraceStages.VALIDATED)
+        self.notify_round_progress(block)
+
     def add_validator(self, validator: Validator):
-        for v in self.validators:
-            if v.address == validator.address:
-                return False
-        self.validators.append(validator)
+        return self.validators.add(validator)
+
+    def generate_wait_time_for_local_validator(self, parent_hash: str = None, validator_count: int = None):
+        # The proposer's validator count, the local view of live validators may differ between nodes
+        if validator_count is None:
+            validator_count = len(self.validators.live())
+        # One wait time per round, another proposer on the same parent gets the same one instead of a new draw
+        if not self.local_validator.has_wait_time(parent_hash):
+            self.local_validator.generate_wait_time(self.wait_time_scheduler, validator_count, parent_hash)
+        self.bump_version()
+        self.notify_round_progress()
+        return self.local_validator.get_wait_time(parent_hash)
+
+    def add_wait_time_for_validator(self, wait_time, address, parent_hash: str = None):
+        validator = self.validators.get(address)
+        if validator is None:
+            return False
+        # The local validator's wait time is set when it is drawn. Its own WAIT_TIME may only be handled after
+        # ADD_ELAPSED_TIME and would undo the elapsed time
+        if validator is not self.local_validator:
+            validator.set_wait_time(wait_time, parent_hash)
+        self.validators.mark_round_response(address)
+        self.bump_version()
+        self.notify_round_progress()
         return True
 
-    def generate_wait_time_for_local_validator(self):
-        self.local_validator.generate_wait_time()
-        return self.local_validator.wait_time
+    def increase_wait_time_for_validator(self, seconds, parent_hash: str = None):
+        for v in self.validators.live():
+            v.add_seconds_to_wait_time(seconds, parent_hash)
+        self.bump_version()
+        self.notify_round_progress()
 
-    def add_wait_time_for_validator(self, wait_time, address):
-        for v in self.validators:
-            if v.address == address:
-                v.set_wait_time(wait_time)
-                return True
-        return False
-
-    def increase_wait_time_for_validator(self, time):
-        for v in self.validators:
-            v.add_seconds_to_wait_time(time)
-
-    def are_all_validators_have_wait_time(self, min_time=0):
-        for v in self.validators:
-            if v.wait_time is None:
+    def are_all_validators_have_wait_time(self, parent_hash: str = None, min_time=0):
+        # Only live validators take part in a round, suspended ones can't stall it
+        for v in self.validators.live():
+            if not v.has_wait_time(parent_hash):
                 return False
-            if v.wait_time <= min_time:
+            if v.get_wait_time(parent_hash) <= min_time:
                 return False
         return True
 
-    def stop_wait_timers(self):
+    def suspend_validators_without_wait_time(self, parent_hash: str = None):
+        for v in self.validators.live():
+            if not v.has_wait_time(parent_hash):
+                self.validators.suspend(v.address)
+
+    def stop_wait_timers(self, parent_hash: str = None):
         for v in self.validators:
-            v.stop_wait_timer()
+            v.stop_wait_timer(parent_hash)
+        self.bump_version()
@@ -1,45 +1,103 @@
 import json
 import logging
+import queue
 import socket
 import threading
+import time
 
 from rsa import PublicKey
 
 from src.blockchain.block import Block
 from src.blockchain.blockchain import Blockchain
+from src.blockchain.lazy_blockchain import LazyBlockchain
 from src.blockchain.smart_contract import VotingSmartContract
 from src.blockchain.transaction import Transaction
+from src.blockchain.transaction_trace import TraceStages
+from src.log_config import SAMPLED
+from src.p2p.admission_control import RateLimiter
 from src.p2p.message import MessageTypes
 from src.p2p.node import Node
 from src.p2p.peer import Peer
+from src.p2p.peer_table import PeerTable
 from src.p2p.validator import Validator
-
-logging.basicConfig(level=logging.DEBUG)
+from src.p2p.validator_registry import ValidatorRegistry
+from src.p2p.wait_time_scheduler import WaitTimeScheduler
 
 HEADER_SIZE = 10
+HEARTBEAT_INTERVAL = 5
+ROUND_TIMEOUT = 15
+SYNC_PEERS = 2
+PROPOSAL_CHECK_INTERVAL = 1
+# Never rate limited, dropping them would stall rounds and get validators suspended
+CONSENSUS_MESSAGES = {MessageTypes.VALIDATE_NEW_BLOCK, MessageTypes.GENERATE_WAIT_TIME, MessageTypes.WAIT_TIME,
+                      MessageTypes.ADD_ELAPSED_TIME, MessageTypes.NEW_BLOCK, MessageTypes.HEARTBEAT}
 
 
 class P2PServer:
-    def __init__(self, host: int, port: int, blockchain: Blockchain):
+    def __init__(self, host: int, port: int, blockchain: Blockchain, workers: int = 32, queue_size: int = 256,
+                 peer_rate: float = None, peer_burst: float = None, sync_workers: int = 0,
+                 wait_time_scheduler: WaitTimeScheduler = None):
         self.host = host
         self.port = port
-        self.p2p_node = Node(blockchain, list(), list())
+        self.p2p_node = Node(blockchain, PeerTable(), ValidatorRegistry(), sync_workers, wait_time_scheduler)
+        # Connections are handled by a fixed pool of workers fed from a bounded queue
+        self.workers = workers
+        self.connections = queue.Queue(maxsize=queue_size)
+        self.peer_limiter = RateLimiter(peer_rate, peer_burst)
+        # Rounds run on their own thread, the next one starts as soon as the previous block is handed to validators
+        self.round_requested = threading.Event()
+        self.proposed_block: Block = None
+        # Validators drop the proposed block once it isn't added by then
+        self.proposal_expires_at = 0
+        # Framed bytes and messages on the P2P port, headers included
+        self.traffic = {'bytes_sent': 0, 'bytes_received': 0, 'messages_sent': 0, 'messages_received': 0}
+        self.traffic_lock = threading.Lock()
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(1)
-        logging.info(f"Listening on {self.host}:{self.port}")
+        # Connections waiting to be accepted, a full backlog makes clients retry their SYN a second later
+        self.server_socket.listen(queue_size)
+        logging.info("Listening on %s:%s", self.host, self.port)
 
     def start(self):
         logging.info("Starting node...")
         self.broadcast_myself()  # Send peer info to other nodes upon starting up
+        threading.Thread(target=self.send_heartbeats, daemon=True).start()
+        threading.Thread(target=self.run_rounds, daemon=True).start()
+        for _ in range(self.workers):
+            threading.Thread(target=self.handle_connections, daemon=True).start()
         while True:
             try:
                 conn, addr = self.server_socket.accept()
-                logging.info(f"Accepted connection from {addr}")
-                threading.Thread(target=self.handle_connection, args=(conn,)).start()
+                logging.debug("Accepted connection from %s", addr, extra=SAMPLED)
+                try:
+                    self.connections.put_nowait(conn)
+                except queue.Full:
+                    self.reject_connection(conn, "handler queue is full")
+            except Exception as e:
+                logging.exception(e)
+
+    def handle_connections(self):
+        while True:
+            conn = self.connections.get()
+            try:
+                conn.settimeout(30)
+                self.handle_connection(conn)
             except Exception as e:
                 logging.exception(e)
 
+    def reject_connection(self, conn, reason):
+        # Senders don't read from the connection, closing it unread is all the backpressure they get
+        logging.warning("Node is busy, rejecting connection: %s", reason, extra=SAMPLED)
+        conn.close()
+
+    def get_limit_key(self, message, host):
+        # Connections come from ephemeral ports, so peers are told apart by host. The sender field a node puts into its
+        # messages only separates the nodes of a host, e.g. a localhost cluster, when it names a known peer
+        sender = message.get('sender')
+        if sender and Peer.from_dict(sender) in self.p2p_node.peers:
+            return sender['host'], sender['port']
+        return host
+
     def receive_all(self, conn, length):
         data = b''
         while len(data) < length:
@@ -60,6 +118,7 @@ class P2PServer:
         body = self.receive_all(conn, msg_len)
         if not body:
             return None
+        self.count_traffic('received', HEADER_SIZE + msg_len)
         # Decode message body from bytes to JSON
         message = json.loads(body.decode())
         return message
@@ -69,28 +128,32 @@ class P2PServer:
             message = self.receive_message(conn)
             host, port = conn.getpeername()
             curr_peer = Peer(host, port)
-            logging.info(f"Received {message} from {curr_peer.to_dict()}")
+            logging.debug("Received %s from %s:%s", message, host, port, extra=SAMPLED)
+            limited = message['type'] not in CONSENSUS_MESSAGES
+            if limited and not self.peer_limiter.allow(self.get_limit_key(message, host)):
+                logging.warning("Dropping %s from %s, it is over its rate limit", message['type'], host, extra=SAMPLED)
+                return
 
             if message['type'] == MessageTypes.NEW_TRANSACTION:
                 transaction = Transaction.from_dict(message['transaction'])
                 if self.p2p_node.add_transaction(transaction):
-                    logging.info(f"Sending transaction {message}")
+                    logging.debug("Sending transaction %s", message, extra=SAMPLED)
                     self.broadcast(message)
+                    self.p2p_node.blockchain.tracer.record(transaction.get_id(), TraceStages.BROADCAST)
             elif message['type'] == MessageTypes.NEW_BLOCK:
                 block = Block.from_dict(message['block'])
                 if self.p2p_node.add_block(block):
-                    logging.info(f"Sending block {message}")
+                    logging.debug("Sending block %s", message, extra=SAMPLED)
                     self.broadcast(message)
             elif message['type'] == MessageTypes.NEW_PEER:
                 peer = Peer.from_dict(message['peer'])
-                if peer not in self.p2p_node.peers:
-                    self.p2p_node.add_peer(peer)
+                self.p2p_node.add_peer(peer)
                 # self.broadcast_peers()
                 # self.sync()
             elif message['type'] == MessageTypes.NEW_VALIDATOR:
                 validator = Validator.from_dict(message['validator'])
                 if self.p2p_node.add_validator(validator):
-                    logging.info(f"Sending validator {validator}")
+                    logging.info("Sending validator %s", validator)
                     self.broadcast(message)
             elif message['type'] == MessageTypes.GET_BLOCKCHAIN:
                 # pass
@@ -105,7 +168,9 @@ class P2PServer:
                     tx = Transaction.from_dict(tx_dict)
                     self.p2p_node.add_transaction(tx)
             elif message['type'] == MessageTypes.BLOCKCHAIN:
-                blockchain = Blockchain.from_dict(message['blockchain'])
+                blockchain = LazyBlockchain(message['blockchain'])
+                if 'address' in message:
+                    self.p2p_node.peers.update_tip(Peer.from_dict(message['address']), len(blockchain) - 1)
                 if self.p2p_node.sync_blockchain(blockchain):
                     self.broadcast_blockchain()
             elif message['type'] == MessageTypes.SYNC:
@@ -113,27 +178,34 @@ class P2PServer:
                 # self.sync_with_peer(curr_peer)
             elif message['type'] == MessageTypes.VALIDATE_NEW_BLOCK:
                 block = Block.from_dict(message['block'])
-                if self.p2p_node.validate_block(block):
-                    logging.info(f"Sending block {message}")
+                if self.p2p_node.validate_block(block, ROUND_TIMEOUT):
+                    logging.debug("Sending block %s", message, extra=SAMPLED)
                     self.send_block(block)
             elif message['type'] == MessageTypes.GENERATE_WAIT_TIME:
-                wait_time = self.p2p_node.generate_wait_time_for_local_validator()
+                parent_hash = message['parent_hash']
+                wait_time = self.p2p_node.generate_wait_time_for_local_validator(parent_hash,
+                                                                                 message.get('validator_count'))
                 address = self.p2p_node.local_validator.address
                 peer = Peer.from_dict(message['address'])
-                self.send_wait_time(peer, wait_time, address)
+                self.send_wait_time(peer, wait_time, address, parent_hash)
             elif message['type'] == MessageTypes.WAIT_TIME:
                 wait_time = message['wait_time']
                 address = Peer.from_dict(message['address'])
-                self.p2p_node.add_wait_time_for_validator(wait_time, address)
+                self.p2p_node.add_wait_time_for_validator(wait_time, address, message['parent_hash'])
             elif message['type'] == MessageTypes.ADD_ELAPSED_TIME:
-                time = message['time']
-                self.p2p_node.increase_wait_time_for_validator(time)
+                elapsed_time = message['time']
+                self.p2p_node.increase_wait_time_for_validator(elapsed_time, message['parent_hash'])
+            elif message['type'] == MessageTypes.HEARTBEAT:
+                address = Peer.from_dict(message['address'])
+                self.p2p_node.validators.heartbeat(address)
+                self.p2p_node.peers.update_tip(address, message['height'])
             else:
-                logging.warning(f"Invalid message type: {message['type']}")
+                logging.warning("Invalid message type: %s", message['type'])
 
     def broadcast(self, message):
-        logging.info(f"Broadcasting {message}")
-        for peer in self.p2p_node.peers:
+        logging.debug("Broadcasting %s", message, extra=SAMPLED)
+        # Peers backed off after failures are skipped until their retry time
+        for peer in self.p2p_node.peers.available():
             self.send_message(peer, message)
 
     def send_message(self, peer, message):
@@ -151,19 +223,42 @@ class P2PServer:
                     s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
                     keepalive = s.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
 
+                started = time.monotonic()
                 s.connect((peer.host, peer.port))
+                # The TCP handshake takes one round trip
+                rtt = time.monotonic() - started
 
-                # Convert message to bytes
-                message_bytes = json.dumps(message).encode()
+                encoded = self.encode_message({**message, 'sender': Peer(self.host, self.port).to_dict()})
+                s.sendall(encoded)
+                self.count_traffic('sent', len(encoded))
+                self.p2p_node.peers.record_success(peer, rtt)
 
-                # Create header
-                header = f"{len(message_bytes):<10}".encode()
+            except ConnectionRefusedError:
+                logging.warning("Connection to %s:%s refused", peer.host, peer.port, extra=SAMPLED)
+                self.p2p_node.peers.record_failure(peer)
+            except OSError as e:
+                logging.warning("Sending to %s:%s failed: %s", peer.host, peer.port, e, extra=SAMPLED)
+                self.p2p_node.peers.record_failure(peer)
 
-                # Send header and message together
-                s.sendall(header + message_bytes)
+    def count_traffic(self, direction, size):
+        with self.traffic_lock:
+            self.traffic[f'bytes_{direction}'] += size
+            self.traffic[f'messages_{direction}'] += 1
 
-            except ConnectionRefusedError:
-                logging.warning(f"Connection to {peer} refused")
+    def get_traffic(self):
+        with self.traffic_lock:
+            return dict(self.traffic)
+
+    @staticmethod
+    def encode_message(message):
+        # Convert message to bytes
+        message_bytes = json.dumps(message).encode()
+
+        # Create header
+        header = f"{len(message_bytes):<10}".encode()
+
+        # Send header and message together
+        return header + message_bytes
 
     def broadcast_peers(self):
         for peer in self.p2p_node.peers:
@@ -175,11 +270,13 @@ class P2PServer:
         self.broadcast(message)
 
     def send_blockchain(self, peer):
-        message = {'type': MessageTypes.BLOCKCHAIN, 'blockchain': self.p2p_node.blockchain.to_dict()}
+        message = {'type': MessageTypes.BLOCKCHAIN, 'blockchain': self.p2p_node.blockchain.to_dict(),
+                   'address': Peer(self.host, self.port).to_dict()}
         self.send_message(peer, message)
 
     def broadcast_blockchain(self):
-        message = {'type': MessageTypes.BLOCKCHAIN, 'blockchain': self.p2p_node.blockchain.to_dict()}
+        message = {'type': MessageTypes.BLOCKCHAIN, 'blockchain': self.p2p_node.blockchain.to_dict(),
+                   'address': Peer(self.host, self.port).to_dict()}
         self.broadcast(message)
 
     def send_pending_transactions(self, peer):
@@ -188,9 +285,10 @@ class P2PServer:
         self.send_message(peer, message)
 
     def broadcast_pending_transactions(self):
-        message = {'type': MessageTypes.PENDING_TRANSACTIONS,
-                   'transactions': [tx.to_dict() for tx in self.p2p_node.blockchain.pending_transactions]}
+        pending = self.p2p_node.blockchain.pending_transactions
+        message = {'type': MessageTypes.PENDING_TRANSACTIONS, 'transactions': [tx.to_dict() for tx in pending]}
         self.broadcast(message)
+        self.p2p_node.blockchain.tracer.record_many([tx.get_id() for tx in pending], TraceStages.BROADCAST)
 
     def broadcast_contracts(self):
         contracts = self.p2p_node.blockchain.contracts
@@ -209,15 +307,17 @@ class P2PServer:
         self.broadcast(message)
 
     def sync(self):
-        logging.info(f"Syncing node with peers {[peer.to_dict() for peer in self.p2p_node.peers]}")
-        for peer in self.p2p_node.peers:
+        # Only the fastest peers at the best known height are asked for their chain
+        peers = self.p2p_node.peers.select_sync_peers(SYNC_PEERS, len(self.p2p_node.blockchain.chain) - 1)
+        logging.info("Syncing node with peers %s", [peer.to_dict() for peer in peers])
+        for peer in peers:
             self.send_message(peer,
                               {'type': MessageTypes.GET_BLOCKCHAIN, 'address': Peer(self.host, self.port).to_dict()})
 
     def connect_to_peer(self, host, port):
         peer = Peer(host, port)
         if peer not in self.p2p_node.peers:
-            self.p2p_node.peers.append(peer)
+            self.p2p_node.add_peer(peer)
             self.send_message(peer, {'type': MessageTypes.NEW_PEER, 'peer': Peer(self.host, self.port).to_dict()})
             self.sync()
             return True
@@ -239,49 +339,155 @@ class P2PServer:
             return True
         return False
 
+    def send_heartbeats(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                # Keeps validators alive and tells peers our tip height
+                self.broadcast({'type': MessageTypes.HEARTBEAT, 'address': Peer(self.host, self.port).to_dict(),
+                                'height': len(self.p2p_node.blockchain.chain) - 1})
+                if self.p2p_node.validators.expire():
+                    self.p2p_node.notify_round_progress()
+                if self.p2p_node.peers.prune():
+                    self.p2p_node.bump_version()
+            except Exception as e:
+                logging.exception(e)
+
+    def wait_for_wait_times(self, parent_hash: str):
+        # Validators that don't answer within ROUND_TIMEOUT are suspended so the round can finish without them
+        deadline = time.time() + ROUND_TIMEOUT
+        round_progress = self.p2p_node.round_progress
+        with round_progress:
+            while not self.p2p_node.are_all_validators_have_wait_time(parent_hash):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logging.warning("Round timed out, suspending validators without wait time")
+                    self.p2p_node.suspend_validators_without_wait_time(parent_hash)
+                    deadline = time.time() + ROUND_TIMEOUT
+                    continue
+                round_progress.wait(remaining)
+
     def start_validating(self):
-        min_elapsed_time = self.init_new_round()
-        while not self.p2p_node.are_all_validators_have_wait_time(min_elapsed_time):
-            pass
+        self.round_requested.set()
 
+    def run_rounds(self):
+        while True:
+            # A proposal validators may still drop keeps its transactions out of new blocks, once it is resolved or
+            # went stale the pending pool is checked again without waiting for a new request. The same goes for a
+            # round that failed while enough transactions are pending
+            retry = self.has_open_proposal() or self.is_next_block_ready()
+            self.round_requested.wait(PROPOSAL_CHECK_INTERVAL if retry else None)
+            self.round_requested.clear()
+            try:
+                while self.is_next_block_ready() and self.run_round():
+                    pass
+            except Exception as e:
+                logging.exception(e)
+
+    def has_open_proposal(self) -> bool:
+        # Not added yet, its parent is still the tip and validators haven't dropped it yet
+        proposed = self.proposed_block
+        blockchain = self.p2p_node.blockchain
+        return proposed is not None and proposed.hash not in blockchain.block_tree and \
+            proposed.previous_hash == blockchain.last_block.hash and time.time() < self.proposal_expires_at
+
+    def is_next_block_ready(self) -> bool:
+        proposed = self.proposed_block
+        in_flight = [tx.get_id() for tx in proposed.transactions] if self.has_open_proposal() else []
+        return self.p2p_node.blockchain.need_new_block(in_flight)
+
+    def get_round_parent(self) -> str:
+        # While the block of the previous round propagates, the lottery for the next one already runs on top of it
+        tip = self.p2p_node.blockchain.last_block.hash
+        proposed = self.proposed_block
+        if proposed is not None and proposed.previous_hash == tip:
+            return proposed.hash
+        return tip
+
+    def wait_for_parent(self, parent_hash: str) -> bool:
+        # False when the tip moved somewhere else than the round's parent, the round is then dropped
+        base = self.p2p_node.blockchain.last_block.hash
+        deadline = time.time() + ROUND_TIMEOUT
+        round_progress = self.p2p_node.round_progress
+        with round_progress:
+            while True:
+                tip = self.p2p_node.blockchain.last_block.hash
+                if tip == parent_hash:
+                    return True
+                remaining = deadline - time.time()
+                if tip != base or remaining <= 0:
+                    return False
+                round_progress.wait(remaining)
+
+    def run_round(self) -> bool:
+        if not self.p2p_node.validators.live():
+            logging.warning("No live validators, block is not created")
+            return False
+        parent_hash = self.get_round_parent()
+        self.init_new_round(parent_hash)
+
+        if not self.wait_for_parent(parent_hash):
+            logging.info("Dropping round on %s, the tip is %s", parent_hash, self.p2p_node.blockchain.last_block.hash)
+            return True
+        if not self.p2p_node.blockchain.need_new_block():
+            return False
         block_to_add = self.p2p_node.blockchain.get_new_block()
+        if block_to_add.previous_hash != parent_hash:
+            return True
+        self.proposed_block = block_to_add
+        # The same deadline as Node.validate_block on the validator with the longest wait time
+        wait_times = [v.get_wait_time(parent_hash) for v in self.p2p_node.validators.live()
+                      if v.has_wait_time(parent_hash)]
+        self.proposal_expires_at = time.time() + max(wait_times, default=0) + ROUND_TIMEOUT
         message = {
             'type': MessageTypes.VALIDATE_NEW_BLOCK,
             'block': block_to_add.to_dict(),
         }
-        for v in self.p2p_node.validators:
+        self.p2p_node.blockchain.tracer.record_many([tx.get_id() for tx in block_to_add.transactions],
+                                                    TraceStages.PROPOSED)
+        for v in self.p2p_node.validators.live():
             self.send_message(v.address, message)
+        return True
 
-    def init_new_round(self):
-        self.generate_wait_times()
-        return self.add_elapsed_time()
+    def init_new_round(self, parent_hash: str):
+        self.generate_wait_times(parent_hash)
+        return self.add_elapsed_time(parent_hash)
 
-    def generate_wait_times(self):
+    def generate_wait_times(self, parent_hash: str):
+        self.p2p_node.validators.start_round()
+        validators = self.p2p_node.validators.live()
         message = {
             'type': MessageTypes.GENERATE_WAIT_TIME,
-            'address': Peer(self.host, self.port).to_dict()
+            'address': Peer(self.host, self.port).to_dict(),
+            'parent_hash': parent_hash,
+            'validator_count': len(validators),
         }
-        for v in self.p2p_node.validators:
+        for v in validators:
             self.send_message(v.address, message)
 
-    def send_wait_time(self, peer, wait_time, address: Peer):
+    def send_wait_time(self, peer, wait_time, address: Peer, parent_hash: str):
         message = {
             'type': MessageTypes.WAIT_TIME,
             'wait_time': wait_time,
-            'address': address.to_dict()
+            'address': address.to_dict(),
+            'parent_hash': parent_hash,
         }
         self.send_message(peer, message)
 
-    def add_elapsed_time(self):
-        while not self.p2p_node.are_all_validators_have_wait_time():
-            pass
+    def add_elapsed_time(self, parent_hash: str):
+        self.wait_for_wait_times(parent_hash)
 
-        elapsed_times = [v.wait_time for v in self.p2p_node.validators]
+        elapsed_times = [v.get_wait_time(parent_hash) for v in self.p2p_node.validators.live()
+                         if v.has_wait_time(parent_hash)]
         min_elapsed_time = min(elapsed_times)
+        # Added here instead of through its own message, a WAIT_TIME answered late for the same parent would undo it
+        self.p2p_node.increase_wait_time_for_validator(min_elapsed_time, parent_hash)
         message = {
             'type': MessageTypes.ADD_ELAPSED_TIME,
-            'time': min_elapsed_time
+            'time': min_elapsed_time,
+            'parent_hash': parent_hash,
         }
-        for v in self.p2p_node.validators:
-            self.send_message(v.address, message)
+        for v in self.p2p_node.validators.live():
+            if v is not self.p2p_node.local_validator:
+                self.send_message(v.address, message)
         return min_elapsed_time
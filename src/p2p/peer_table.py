@@ -0,0 +1,110 @@
+import itertools
+import logging
+import time
+from threading import Lock
+from typing import Dict, List
+
+from src.p2p.peer import Peer
+
+RTT_SMOOTHING = 0.2
+
+
+class PeerTable:
+    # Known peers with link health. Peers failing in a row are backed off exponentially and pruned after max_failures
+    def __init__(self, base_backoff: float = 1, max_backoff: float = 60, max_failures: int = 8):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_failures = max_failures
+        self.peers: Dict[Peer, None] = {}
+        self.rtt: Dict[Peer, float] = {}
+        self.failures: Dict[Peer, int] = {}
+        self.tip_height: Dict[Peer, int] = {}
+        self.last_seen: Dict[Peer, float] = {}
+        self.retry_at: Dict[Peer, float] = {}
+        self.lock = Lock()
+        # Bumped on membership changes
+        self.versions = itertools.count(1)
+        self.version = 0
+
+    def bump_version(self):
+        self.version = next(self.versions)
+
+    def __contains__(self, peer: Peer) -> bool:
+        return peer in self.peers
+
+    def __iter__(self):
+        return iter(list(self.peers))
+
+    def __len__(self):
+        return len(self.peers)
+
+    def add(self, peer: Peer) -> bool:
+        with self.lock:
+            if peer in self.peers:
+                return False
+            self.peers[peer] = None
+            self.failures[peer] = 0
+            self.bump_version()
+            return True
+
+    def remove(self, peer: Peer):
+        with self.lock:
+            if self.peers.pop(peer, False) is False:
+                return
+            for stats in (self.rtt, self.failures, self.tip_height, self.last_seen, self.retry_at):
+                stats.pop(peer, None)
+            self.bump_version()
+
+    def available(self) -> List[Peer]:
+        # Peers not backed off, a backed off peer gets one attempt once its retry time has passed
+        now = time.time()
+        return [peer for peer in list(self.peers) if self.retry_at.get(peer, 0) <= now]
+
+    def record_success(self, peer: Peer, rtt: float = None):
+        if peer not in self.peers:
+            return
+        if rtt is not None:
+            previous = self.rtt.get(peer)
+            self.rtt[peer] = rtt if previous is None else (1 - RTT_SMOOTHING) * previous + RTT_SMOOTHING * rtt
+        self.failures[peer] = 0
+        self.retry_at.pop(peer, None)
+        self.last_seen[peer] = time.time()
+
+    def record_failure(self, peer: Peer):
+        if peer not in self.peers:
+            return
+        failures = self.failures.get(peer, 0) + 1
+        self.failures[peer] = failures
+        self.retry_at[peer] = time.time() + min(self.max_backoff, self.base_backoff * 2 ** (failures - 1))
+
+    def update_tip(self, peer: Peer, height: int):
+        if peer not in self.peers:
+            return
+        self.tip_height[peer] = height
+        self.last_seen[peer] = time.time()
+
+    def prune(self) -> List[Peer]:
+        pruned = [peer for peer in list(self.peers) if self.failures.get(peer, 0) >= self.max_failures]
+        for peer in pruned:
+            logging.info("Peer %s pruned after %s failed attempts", peer.to_dict(), self.failures[peer])
+            self.remove(peer)
+        return pruned
+
+    def select_sync_peers(self, count: int, local_height: int) -> List[Peer]:
+        # The fastest peers at the best known height, peers whose tip isn't known yet come after them
+        available = self.available()
+        heights = [self.tip_height.get(peer) for peer in available]
+        target = max([height for height in heights if height is not None] + [local_height])
+        candidates = [peer for peer in available if self.tip_height.get(peer, target) >= target]
+        candidates.sort(key=lambda peer: (peer not in self.tip_height, self.rtt.get(peer, float("inf"))))
+        return candidates[:count]
+
+    def get_stats(self, peer: Peer) -> dict:
+        return {
+            **peer.to_dict(),
+            "rtt": self.rtt.get(peer),
+            "failures": self.failures.get(peer, 0),
+            "tip_height": self.tip_height.get(peer),
+            "last_seen": self.last_seen.get(peer),
+            "backed_off": self.retry_at.get(peer, 0) > time.time(),
+        }
@@ -0,0 +1,89 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from typing import List
+
+from src.blockchain.block import Block
+from src.blockchain.blockchain import Blockchain
+from src.blockchain.lazy_blockchain import LazyBlockchain
+
+
+def verify_blocks(block_dicts: List[dict]) -> List[Block]:
+    # Decode and verify stage, runs in a worker process. Invalid blocks come back as None
+    blocks = []
+    for block_dict in block_dicts:
+        block = Block.from_dict(block_dict)
+        blocks.append(block if Blockchain.verify_block(block) else None)
+    return blocks
+
+
+class SyncPipeline:
+    # Remote blocks flow decode/verify (parallel) -> hash links (in order) -> apply, through bounded queues
+    def __init__(self, blockchain: Blockchain, workers: int = 0, batch_size: int = 16, queue_size: int = 8):
+        self.blockchain = blockchain
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.pool = None
+        # One sync at a time, a concurrent one then only sees the blocks the first didn't bring
+        self.lock = threading.Lock()
+
+    def sync(self, remote: LazyBlockchain) -> bool:
+        with self.lock:
+            block_dicts = remote.get_block_dicts_after(self.blockchain.block_tree)
+            if not block_dicts:
+                return False
+            # Catch-ups that fit into one batch are cheaper to verify inline than to ship to the pool
+            parallel = self.workers > 0 and len(block_dicts) > self.batch_size
+            if parallel and self.pool is None:
+                self.pool = multiprocessing.get_context('spawn').Pool(self.workers)
+            batches = queue.Queue(maxsize=self.queue_size)
+            stop = threading.Event()
+            threading.Thread(target=self.feed, args=(block_dicts, batches, stop, parallel), daemon=True).start()
+            return self.apply(batches, stop)
+
+    def feed(self, block_dicts: List[dict], batches: queue.Queue, stop: threading.Event, parallel: bool):
+        # Batches are queued in chain order, the bounded queue keeps the verifying workers at most queue_size ahead
+        for start in range(0, len(block_dicts), self.batch_size):
+            if stop.is_set():
+                break
+            batch = block_dicts[start:start + self.batch_size]
+            batches.put(self.pool.apply_async(verify_blocks, (batch,)) if parallel else batch)
+        batches.put(None)
+
+    def apply(self, batches: queue.Queue, stop: threading.Event) -> bool:
+        changed = False
+        previous_hash = None
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return changed
+            if stop.is_set():
+                # Drained so the feeder is never stuck on a full queue
+                continue
+            try:
+                blocks = verify_blocks(batch) if isinstance(batch, list) else batch.get()
+            except Exception as e:
+                logging.exception(e)
+                stop.set()
+                continue
+            for block in blocks:
+                if block is None:
+                    logging.warning("Sync stopped: remote chain has an invalid block")
+                    stop.set()
+                    break
+                # The first block has to attach to the local tree, every next one to the block before it
+                linked = block.previous_hash in self.blockchain.block_tree if previous_hash is None \
+                    else block.previous_hash == previous_hash
+                if not linked:
+                    logging.warning("Sync stopped: block %s does not link to %s", block.hash, previous_hash)
+                    stop.set()
+                    break
+                if self.blockchain.add_existing_block(block, verified=True):
+                    changed = True
+                previous_hash = block.hash
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.terminate()
@@ -1,48 +1,118 @@
-import random
 import threading
+from collections import OrderedDict
+from typing import Dict
 
 from rsa import PublicKey
 
 from src.blockchain.block import Block
 from src.p2p.peer import Peer
+from src.p2p.wait_time_scheduler import WaitTimeScheduler
+
+VALIDATED_BLOCKS_WINDOW = 16
+# Rounds of consecutive blocks overlap and several nodes may propose on the same parent, so wait times are kept for a
+# few parents at once until their round ends
+OPEN_ROUNDS = 16
+
+
+class ValidatedBlocks:
+    # Hashes of the most recent blocks whose wait timer fired, older ones are no longer needed by consensus
+    def __init__(self, max_size: int = VALIDATED_BLOCKS_WINDOW):
+        self.max_size = max_size
+        self.hashes = OrderedDict()
+
+    def add(self, block_hash: str):
+        self.hashes[block_hash] = None
+        self.hashes.move_to_end(block_hash)
+        while len(self.hashes) > self.max_size:
+            self.hashes.popitem(last=False)
+
+    def __contains__(self, block) -> bool:
+        return (block.hash if isinstance(block, Block) else block) in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def to_list(self):
+        return list(self.hashes)
 
 
 class Validator:
     def __init__(self, public_key: PublicKey, address: Peer):
         self.public_key = public_key
         self.address = address
-        self.wait_time = None
-        self.wait_timer = None
-        self.block_to_add = None
-        self.validated_blocks = []
+        # Wait time per hash of the parent block it was drawn for
+        self.wait_times = OrderedDict()
+        # Parents whose round already added its elapsed time, every proposer on the parent sends one
+        self.elapsed_rounds = set()
+        # Block being validated and its wait timer per parent hash, a block on the next parent may arrive while the
+        # timer of its parent still runs
+        self.blocks_to_add: Dict[str, Block] = {}
+        self.wait_timers: Dict[str, threading.Timer] = {}
+        self.validated_blocks = ValidatedBlocks()
+        # Called with the block when the wait timer fires, set for the local validator
+        self.on_validated = None
+
+    def start_wait_timer(self, parent_hash: str, wait_time: float):
+        timer = threading.Timer(wait_time, self.add_block, (parent_hash,))
+        self.wait_timers[parent_hash] = timer
+        timer.start()
 
-    def start_wait_timer(self):
-        self.wait_timer = threading.Timer(self.wait_time, self.add_block)
-        self.wait_timer.start()
+    def stop_wait_timer(self, parent_hash: str = None):
+        # Ends the round on parent_hash (every round when None), rounds on other parents keep running
+        for parent in list(self.blocks_to_add) if parent_hash is None else [parent_hash]:
+            timer = self.wait_timers.pop(parent, None)
+            if timer:
+                timer.cancel()
+            self.blocks_to_add.pop(parent, None)
+        if parent_hash is None:
+            self.wait_times.clear()
+            self.elapsed_rounds.clear()
+        else:
+            self.wait_times.pop(parent_hash, None)
+            self.elapsed_rounds.discard(parent_hash)
 
-    def stop_wait_timer(self):
-        if self.wait_timer:
-            self.wait_timer.cancel()
-            self.wait_time = None
+    def generate_wait_time(self, scheduler: WaitTimeScheduler, validator_count: int, parent_hash: str = None):
+        self.set_wait_time(scheduler.draw(validator_count), parent_hash)
 
-    def generate_wait_time(self):
-        self.wait_time = random.randint(1, 10)  # Random wait time between 1-10 seconds
+    def set_wait_time(self, wait_time, parent_hash: str = None):
+        # A round on a new parent doesn't replace the wait time of a block still being validated
+        self.wait_times[parent_hash] = wait_time
+        self.wait_times.move_to_end(parent_hash)
+        while len(self.wait_times) > OPEN_ROUNDS:
+            self.elapsed_rounds.discard(self.wait_times.popitem(last=False)[0])
 
-    def set_wait_time(self, wait_time):
-        self.wait_time = wait_time
+    def get_wait_time(self, parent_hash: str):
+        return self.wait_times.get(parent_hash)
 
-    def add_seconds_to_wait_time(self, seconds):
-        self.wait_time += seconds
+    def has_wait_time(self, parent_hash: str) -> bool:
+        return parent_hash in self.wait_times
 
-    def add_block(self):
-        if self.block_to_add:
-            self.validated_blocks.append(self.block_to_add)
-            self.block_to_add = None
+    def add_seconds_to_wait_time(self, seconds, parent_hash: str = None):
+        if self.has_wait_time(parent_hash) and parent_hash not in self.elapsed_rounds:
+            self.elapsed_rounds.add(parent_hash)
+            self.wait_times[parent_hash] += seconds
+
+    def add_block(self, parent_hash: str):
+        self.wait_timers.pop(parent_hash, None)
+        block = self.blocks_to_add.get(parent_hash)
+        if block:
+            # Validated before it stops being pending, so is_validating holds throughout
+            self.validated_blocks.add(block.hash)
+            self.blocks_to_add.pop(parent_hash, None)
+            if self.on_validated is not None:
+                self.on_validated(block)
 
     def validate_block(self, block: Block):
-        if not self.block_to_add:
-            self.block_to_add = block
-            self.start_wait_timer()
+        # Only a wait time drawn for the block's parent takes part in its round, the first block of a round is kept
+        parent_hash = block.previous_hash
+        wait_time = self.get_wait_time(parent_hash)
+        if wait_time is not None and self.blocks_to_add.setdefault(parent_hash, block) is block:
+            self.start_wait_timer(parent_hash, wait_time)
+
+    def is_validating(self, block: Block) -> bool:
+        # False for a block that can't be validated any more, another block of its round holds the timer or it ended
+        pending = self.blocks_to_add.get(block.previous_hash)
+        return block in self.validated_blocks or (pending is not None and pending.hash == block.hash)
 
     def __repr__(self):
         return f"Validator {self.public_key}"
@@ -51,9 +121,9 @@ class Validator:
         return {
             "public_key": self.public_key.save_pkcs1().hex(),
             "address": self.address.to_dict(),
-            "wait_time": self.wait_time,
-            "block_to_add": self.block_to_add.to_dict() if self.block_to_add else None,
-            "validated_blocks": [block.to_dict() for block in self.validated_blocks],
+            "wait_times": dict(self.wait_times),
+            "blocks_to_add": {parent_hash: block.to_dict() for parent_hash, block in list(self.blocks_to_add.items())},
+            "validated_blocks": self.validated_blocks.to_list(),
         }
 
     @classmethod
@@ -61,7 +131,10 @@ class Validator:
         public_key = PublicKey.load_pkcs1(bytes.fromhex(dict_['public_key']))
         address = Peer.from_dict(dict_['address'])
         obj = cls(public_key, address)
-        obj.validated_blocks = [Block.from_dict(block) for block in dict_["validated_blocks"]]
-        obj.wait_time = dict_["wait_time"]
-        obj.block_to_add = Block.from_dict(dict_["block_to_add"]) if dict_["block_to_add"] else None
+        for block_hash in dict_["validated_blocks"]:
+            obj.validated_blocks.add(block_hash)
+        for parent_hash, wait_time in dict_["wait_times"].items():
+            obj.set_wait_time(wait_time, parent_hash)
+        for parent_hash, block_dict in dict_["blocks_to_add"].items():
+            obj.blocks_to_add[parent_hash] = Block.from_dict(block_dict)
         return obj
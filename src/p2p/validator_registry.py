@@ -0,0 +1,94 @@
+import itertools
+import logging
+import time
+from threading import Lock
+from typing import Dict, List
+
+from src.p2p.peer import Peer
+from src.p2p.validator import Validator
+
+
+class ValidatorRegistry:
+    def __init__(self, heartbeat_timeout: float = 30, max_missed_rounds: int = 3):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_missed_rounds = max_missed_rounds
+        self.validators: Dict[Peer, Validator] = {}
+        self.last_seen: Dict[Peer, float] = {}
+        self.last_seen_round: Dict[Peer, int] = {}
+        self.suspended = set()
+        self.local_address: Peer = None
+        self.round = 0
+        self.lock = Lock()
+        # Bumped on membership and liveness changes
+        self.versions = itertools.count(1)
+        self.version = 0
+
+    def bump_version(self):
+        self.version = next(self.versions)
+
+    def __contains__(self, address: Peer) -> bool:
+        return address in self.validators
+
+    def __iter__(self):
+        return iter(list(self.validators.values()))
+
+    def __len__(self):
+        return len(self.validators)
+
+    def get(self, address: Peer) -> Validator:
+        return self.validators.get(address)
+
+    def add(self, validator: Validator, local: bool = False) -> bool:
+        with self.lock:
+            if validator.address in self.validators:
+                return False
+            self.validators[validator.address] = validator
+            self.last_seen[validator.address] = time.time()
+            self.last_seen_round[validator.address] = self.round
+            if local:
+                self.local_address = validator.address
+            self.bump_version()
+            return True
+
+    def live(self) -> List[Validator]:
+        return [v for address, v in list(self.validators.items()) if address not in self.suspended]
+
+    def heartbeat(self, address: Peer) -> bool:
+        if address not in self.validators:
+            return False
+        self.last_seen[address] = time.time()
+        if address in self.suspended:
+            logging.info("Validator %s is alive again", address.to_dict())
+            self.suspended.discard(address)
+            # Suspended validators aren't asked in rounds, without this the next expire would suspend it again
+            self.last_seen_round[address] = self.round
+            self.bump_version()
+        return True
+
+    def start_round(self) -> int:
+        self.round += 1
+        return self.round
+
+    def mark_round_response(self, address: Peer):
+        self.last_seen_round[address] = self.round
+        self.heartbeat(address)
+
+    def suspend(self, address: Peer):
+        if address != self.local_address and address in self.validators:
+            logging.info("Validator %s suspended", address.to_dict())
+            self.suspended.add(address)
+            self.bump_version()
+
+    def expire(self) -> List[Peer]:
+        # Suspends validators without heartbeat for heartbeat_timeout or missing too many rounds. They stay registered,
+        # NEW_VALIDATOR is only sent once, so the next heartbeat of a partitioned validator can still bring it back
+        now = time.time()
+        expired = []
+        for address in list(self.validators):
+            if address == self.local_address or address in self.suspended:
+                continue
+            if now - self.last_seen.get(address, 0) > self.heartbeat_timeout or \
+                    self.round - self.last_seen_round.get(address, 0) > self.max_missed_rounds:
+                expired.append(address)
+                self.suspend(address)
+        return expired
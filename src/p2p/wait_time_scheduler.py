@@ -0,0 +1,76 @@
+import random
+import statistics
+from abc import ABC, abstractmethod
+from typing import List
+
+from src.blockchain.block import Block
+
+
+class SchedulerTypes:
+    UNIFORM = "uniform"  # whole seconds between 1 and 10, independent of the number of validators
+    EXPONENTIAL = "exponential"  # sub-second, scaled so the network hits a target block interval
+
+
+class WaitTimeScheduler(ABC):
+    # Every validator draws from the same distribution, so each one is equally likely to hold the smallest wait time
+    name = None
+
+    def __init__(self, resolution: float = 1.0, target_interval: float = None, window: int = 100):
+        self.resolution = resolution
+        self.target_interval = target_interval
+        self.window = window
+
+    @abstractmethod
+    def draw(self, validator_count: int) -> float:
+        pass
+
+    def round(self, wait_time: float) -> float:
+        # Never 0, a validator with no wait time would win every round it takes part in
+        return max(self.resolution, round(wait_time / self.resolution) * self.resolution)
+
+    def report(self, chain: List[Block]) -> dict:
+        # Achieved interval between the proposal timestamps of the latest main chain blocks, genesis excluded
+        timestamps = [block.timestamp for block in chain[1:]][-(self.window + 1):]
+        intervals = [later - earlier for earlier, later in zip(timestamps, timestamps[1:])]
+        return {
+            "scheduler": self.name,
+            "resolution": self.resolution,
+            "target_interval": self.target_interval,
+            "blocks": len(intervals),
+            "mean_interval": statistics.mean(intervals) if intervals else None,
+            "median_interval": statistics.median(intervals) if intervals else None,
+        }
+
+
+class UniformScheduler(WaitTimeScheduler):
+    name = SchedulerTypes.UNIFORM
+
+    def __init__(self, min_time: float = 1, max_time: float = 10, resolution: float = 1.0, window: int = 100):
+        super().__init__(resolution, None, window)
+        self.min_time = min_time
+        self.max_time = max_time
+
+    def draw(self, validator_count: int) -> float:
+        # Evenly over the grid of the resolution, with the defaults the same as random.randint(1, 10)
+        steps = round((self.max_time - self.min_time) / self.resolution)
+        return self.round(self.min_time + random.randint(0, steps) * self.resolution)
+
+
+class ExponentialScheduler(WaitTimeScheduler):
+    name = SchedulerTypes.EXPONENTIAL
+
+    def __init__(self, target_interval: float = 1.0, resolution: float = 0.001, window: int = 100):
+        super().__init__(resolution, target_interval, window)
+
+    def draw(self, validator_count: int) -> float:
+        # The minimum of n exponential draws with mean m has mean m / n. A round adds the smallest wait time to every
+        # validator, so the winner's timer runs for twice the minimum, which is what the target is matched against.
+        # validator_count is the proposer's count of the round, all validators of a round scale by the same number
+        mean = self.target_interval * max(1, validator_count) / 2
+        return self.round(random.expovariate(1 / mean))
+
+
+def create_scheduler(scheduler_type: str, target_interval: float = 1.0, resolution: float = None) -> WaitTimeScheduler:
+    if scheduler_type == SchedulerTypes.EXPONENTIAL:
+        return ExponentialScheduler(target_interval, resolution if resolution else 0.001)
+    return UniformScheduler(resolution=resolution if resolution else 1.0)
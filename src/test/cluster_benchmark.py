@@ -0,0 +1,310 @@
+import argparse
+import functools
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import Transaction
+from src.blockchain.vote_file import VoteFileWriter, read_header, read_votes
+from src.test.election_workload import (Throughput, batched, generate_votes, is_election_started, send_api_batches,
+                                        setup_election)
+
+# End-to-end benchmark of a localhost cluster: starts real api.py nodes for every cluster size, connects them as a full
+# mesh, registers every node as validator, replays signed votes spread over all nodes and measures when each vote is
+# on the main chain of every node.
+#
+# PYTHONPATH=. python src/test/cluster_benchmark.py --nodes 1 2 4 --votes 1000 --output cluster.json \
+#        --node_args="--wait_time_scheduler exponential --target_block_interval 0.5"
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PERCENTILES = [50, 90, 95, 99]
+REQUEST_TIMEOUT = 30
+STOP_TIMEOUT = 30
+
+
+class ClusterNode:
+    def __init__(self, index: int, api_port: int, p2p_port: int):
+        self.index = index
+        self.api_port = api_port
+        self.p2p_port = p2p_port
+        self.url = f"http://127.0.0.1:{api_port}"
+        self.process: subprocess.Popen = None
+        self.log_path: str = None
+        # Transaction id -> when the vote was first seen on the node's main chain
+        self.committed: Dict[str, float] = {}
+        self.next_height = 0
+
+    def start(self, node_args: List[str], log_dir: str):
+        self.log_path = os.path.join(log_dir, f"node_{self.api_port}.log")
+        command = [sys.executable, "api.py", f"--api_port={self.api_port}", f"--p2p_port={self.p2p_port}", *node_args]
+        with open(self.log_path, "wb") as log:
+            # Own process group, so signing and sync worker processes are stopped with the node
+            self.process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+
+    def wait_until_ready(self, timeout: float):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Node {self.url} exited with {self.process.returncode}, see {self.log_path}")
+            try:
+                if requests.get(f"{self.url}/key/public", timeout=1).status_code == 200:
+                    return
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"Node {self.url} didn't start within {timeout}s, see {self.log_path}")
+
+    def poll_committed(self, session: requests.Session, contract_name: str):
+        params = {"from_height": self.next_height, "contract": contract_name, "method": ContractMethods.VOTE}
+        with session.get(f"{self.url}/export/transactions", params=params, stream=True,
+                         timeout=REQUEST_TIMEOUT) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                self.committed.setdefault(item["transaction_id"], time.time())
+                self.next_height = max(self.next_height, item["height"] + 1)
+
+    def tip_height(self) -> int:
+        return len(requests.get(f"{self.url}/blockchain", timeout=REQUEST_TIMEOUT).json()["chain"]) - 1
+
+    def get_traffic(self) -> dict:
+        return requests.get(f"{self.url}/p2p/traffic", timeout=REQUEST_TIMEOUT).json()
+
+    def stop(self) -> dict:
+        # On SIGTERM the node joins its signing and sync worker processes, so the resource usage reaped here
+        # includes theirs. Reaped here instead of by Popen to get it
+        os.kill(self.process.pid, signal.SIGTERM)
+        deadline = time.time() + STOP_TIMEOUT
+        pid, _, usage = os.wait4(self.process.pid, os.WNOHANG)
+        while not pid:
+            if time.time() > deadline:
+                logging.warning(f"Node {self.url} didn't stop within {STOP_TIMEOUT}s, killing it")
+                os.killpg(self.process.pid, signal.SIGKILL)
+            time.sleep(0.1)
+            pid, _, usage = os.wait4(self.process.pid, os.WNOHANG)
+        # Leftovers of the process group like the multiprocessing resource tracker
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        return {"cpu_user": usage.ru_utime, "cpu_system": usage.ru_stime, "max_rss_kb": usage.ru_maxrss}
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES + [100]}
+    ordered = sorted(values)
+    return {f"p{p}": ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] for p in PERCENTILES + [100]}
+
+
+def load_votes(args) -> (dict, List[dict]):
+    # Signed vote dicts from a vote file, or generated with the election workload
+    if args.input:
+        with open(args.input, "rb") as f:
+            header = read_header(f)
+        with open(args.input, "rb") as f:
+            return header, [tx.to_dict() for tx in read_votes(f)]
+    candidates = [f"Candidate {i}" for i in range(args.candidates)]
+    chunks = [min(args.chunk_size, args.votes - start) for start in range(0, args.votes, args.chunk_size)]
+    buffer = io.BytesIO()
+    writer = VoteFileWriter(buffer, args.contract, candidates, args.key_size // 8)
+    with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+        jobs = [(args.contract, candidates, args.key_size, count) for count in chunks]
+        for records in pool.starmap(generate_votes, jobs):
+            writer.write_encoded(records)
+    buffer.seek(0)
+    header = read_header(buffer)
+    buffer.seek(0)
+    return header, [tx.to_dict() for tx in read_votes(buffer)]
+
+
+def wait_for(condition, timeout: float, description: str):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError(f"Timed out after {timeout}s waiting for {description}")
+        time.sleep(0.5)
+
+
+def form_cluster(nodes: List[ClusterNode], header: dict, timeout: float):
+    for i, node in enumerate(nodes):
+        for other in nodes[:i]:
+            requests.post(f"{node.url}/peers/new", json={"host": "localhost", "port": other.p2p_port},
+                          timeout=REQUEST_TIMEOUT)
+    for node in nodes[1:]:
+        requests.post(f"{node.url}/validators/register", timeout=REQUEST_TIMEOUT)
+    # The first node registers itself while setting up the election, the others have to be known to it by then
+    wait_for(lambda: len(requests.get(f"{nodes[0].url}/validators", timeout=REQUEST_TIMEOUT).json()) == len(nodes) - 1,
+             timeout, "validators to reach the first node")
+    setup_election(nodes[0].url, header)
+    # Votes are rejected until the start of the election is committed, a pending contract is listed already
+    wait_for(lambda: all(is_election_started(node.url, header["contract"]) for node in nodes),
+             timeout, "the election to start on every node")
+
+
+def track_commits(nodes: List[ClusterNode], contract_name: str, interval: float, stop: threading.Event):
+    session = requests.Session()
+    while not stop.is_set():
+        for node in nodes:
+            try:
+                node.poll_committed(session, contract_name)
+            except requests.RequestException as e:
+                logging.warning(f"Polling {node.url} failed: {e}")
+        stop.wait(interval)
+
+
+def run_cluster(size: int, base_port: int, args, header: dict, votes: List[tuple]) -> dict:
+    nodes = [ClusterNode(i, base_port + i, base_port + 1000 + i) for i in range(size)]
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix=f"cluster_{size}_")
+    node_args = args.node_args.split()
+    logging.info(f"Starting {size} nodes, logs in {log_dir}")
+    usage = []
+    try:
+        for node in nodes:
+            node.start(node_args, log_dir)
+        for node in nodes:
+            node.wait_until_ready(args.startup_timeout)
+        form_cluster(nodes, header, args.setup_timeout)
+
+        start_height = nodes[0].tip_height()
+        traffic_before = [node.get_traffic() for node in nodes]
+        stop = threading.Event()
+        tracker = threading.Thread(target=track_commits, args=(nodes, header["contract"], args.poll_interval, stop),
+                                   daemon=True)
+        tracker.start()
+
+        # Votes are spread over the nodes, every sender submits to one node. Votes are stamped right before their
+        # first request, after the rate limiter let it through
+        submitted: Dict[str, float] = {}
+        ids_by_signature = {vote["signature"]: tx_id for tx_id, vote in votes}
+        on_send = functools.partial(stamp_batch, ids_by_signature=ids_by_signature, submitted=submitted)
+        throughput = Throughput(args.rate)
+        senders = []
+        for i, node in enumerate(nodes):
+            batches = batched([vote for _, vote in votes[i::size]], args.batch_size)
+            lock = threading.Lock()
+            senders += [threading.Thread(target=send_api_batches, args=(node.url, batches, lock, throughput, on_send),
+                                         daemon=True) for _ in range(args.connections)]
+        started = time.time()
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        sent = time.time()
+        logging.info(f"{size} nodes: {throughput.report()}")
+
+        # Fewer than 5 votes left pending never make a block, so waiting also ends when commits stop coming in
+        ids = [tx_id for tx_id, _ in votes]
+        deadline = time.time() + args.finality_timeout
+        progress, progress_at = -1, time.time()
+        while time.time() < deadline and time.time() < progress_at + args.idle_timeout:
+            committed = sum(len(node.committed) for node in nodes)
+            if committed == len(ids) * size:
+                break
+            if committed != progress:
+                progress, progress_at = committed, time.time()
+            time.sleep(args.poll_interval)
+        stop.set()
+        tracker.join()
+        finished = time.time()
+
+        finality = [max(node.committed[vote] for node in nodes) - submitted[vote] for vote in ids
+                    if vote in submitted and all(vote in node.committed for node in nodes)]
+        blocks = nodes[0].tip_height() - start_height
+        traffic = [{key: after[key] - before[key] for key in after}
+                   for before, after in zip(traffic_before,
+                                            [node.get_traffic() for node in nodes])]
+    finally:
+        for node in nodes:
+            if node.process is not None:
+                usage.append(node.stop())
+
+    elapsed = finished - started
+    result = {
+        "nodes": size,
+        "votes": len(votes),
+        "finalized": len(finality),
+        "submit_seconds": sent - started,
+        "elapsed_seconds": elapsed,
+        "finality_seconds": percentiles(finality),
+        "blocks": blocks,
+        "blocks_per_second": blocks / elapsed,
+        "votes_per_second": len(finality) / elapsed,
+        "per_node": [{"url": node.url, **node_traffic, **node_usage}
+                     for node, node_traffic, node_usage in zip(nodes, traffic, usage)],
+    }
+    result["mean_bytes_sent"] = sum(t["bytes_sent"] for t in traffic) / size
+    result["mean_bytes_received"] = sum(t["bytes_received"] for t in traffic) / size
+    result["mean_cpu_seconds"] = sum(u["cpu_user"] + u["cpu_system"] for u in usage) / size
+    logging.info(f"{size} nodes: {len(finality)}/{len(votes)} votes final on every node, "
+                 f"p50 {result['finality_seconds']['p50']}, p99 {result['finality_seconds']['p99']}, "
+                 f"{result['blocks_per_second']:.2f} blocks/s, {result['mean_bytes_sent']:.0f} bytes sent per node, "
+                 f"{result['mean_cpu_seconds']:.1f}s CPU per node")
+    return result
+
+
+def stamp_batch(batch: List[dict], ids_by_signature: Dict[str, str], submitted: Dict[str, float]):
+    now = time.time()
+    for vote in batch:
+        submitted.setdefault(ids_by_signature[vote["signature"]], now)
+
+
+def main(args):
+    header, votes = load_votes(args)
+    # The same signed votes are replayed into every cluster size
+    votes = [(Transaction.from_dict(vote).get_id(), vote) for vote in votes]
+    logging.info(f"Replaying {len(votes)} votes for {header['contract']} into clusters of {args.nodes} nodes")
+    # Every cluster gets fresh ports, sockets of the previous one may still be in TIME_WAIT
+    offsets = [sum(args.nodes[:i]) for i in range(len(args.nodes))]
+    results = [run_cluster(size, args.base_port + offset, args, header, votes)
+               for size, offset in zip(args.nodes, offsets)]
+    report = {"timestamp": time.time(), "config": vars(args), "runs": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Wrote results to {args.output}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Benchmark vote finality of localhost clusters of growing size")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 2, 4], help="Cluster sizes to run")
+    parser.add_argument("--output", type=str, default="cluster_benchmark.json", help="JSON file with the results")
+    parser.add_argument("--input", type=str, help="Vote file to replay, generated when not set")
+    parser.add_argument("--votes", type=int, default=1000, help="Votes to generate")
+    parser.add_argument("--contract", type=str, default="Benchmark", help="Contract name of generated votes")
+    parser.add_argument("--candidates", type=int, default=3, help="Candidates of generated votes")
+    parser.add_argument("--key-size", type=int, default=512, help="Voter key size in bits")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="Processes generating votes")
+    parser.add_argument("--chunk-size", type=int, default=250, help="Votes generated per task")
+    parser.add_argument("--node_args", type=str, default="", help="Extra api.py arguments for every node")
+    parser.add_argument("--base_port", type=int, default=7000,
+                        help="First API port, P2P ports are 1000 above")
+    parser.add_argument("--log_dir", type=str, help="Directory for node logs, a temporary one when not set")
+    parser.add_argument("--rate", type=float, default=0, help="Votes per second over all nodes, 0 is unlimited")
+    parser.add_argument("--batch-size", type=int, default=50, help="Votes per bulk API request")
+    parser.add_argument("--connections", type=int, default=1, help="Concurrent senders per node")
+    parser.add_argument("--poll_interval", type=float, default=0.2,
+                        help="Seconds between polls of the nodes' chains, bounds the finality resolution")
+    parser.add_argument("--startup_timeout", type=float, default=30, help="Seconds for a node to start")
+    parser.add_argument("--setup_timeout", type=float, default=60,
+                        help="Seconds for validators and the election to reach every node")
+    parser.add_argument("--finality_timeout", type=float, default=120,
+                        help="Seconds to wait for the last votes after sending")
+    parser.add_argument("--idle_timeout", type=float, default=30,
+                        help="Seconds without a new vote committed on any node before waiting ends")
+    main(parser.parse_args())
@@ -0,0 +1,166 @@
+import logging
+import random
+import time
+
+import gevent
+import requests
+from locust import HttpUser, task, between, events
+from locust.runners import MasterRunner, WorkerRunner
+
+from src.blockchain.vote_file import read_header, read_votes
+from src.test.election_workload import is_election_started
+
+
+# precondition: start a local cluster (e.g. nodes on 6000, 6001, 6002 connected through /peers/new).
+# Full election: create contract -> add candidates -> start voting -> votes from distinct voter keys -> finish ->
+# results
+# Votes are signed up front by election_workload.py, generating RSA keys in a task would block the gevent loop
+#
+# PYTHONPATH=. python src/test/election_workload.py generate --voters 10000 --output election.votes
+# PYTHONPATH=. locust -f src/test/election_load_test.py --headless -u 50 -r 10 -t 2m --vote-file election.votes \
+#        --nodes http://127.0.0.1:6000,http://127.0.0.1:6001,http://127.0.0.1:6002 --register-validators
+#
+# Distributed runs must pass every worker a vote file of its own, generated for the same --contract.
+
+# signature hex -> time the vote was accepted by a node
+submitted_votes = {}
+# Contract and candidates of the vote file, and its votes, read as they are cast
+election = {}
+votes = iter(())
+
+
+@events.init_command_line_parser.add_listener
+def init_parser(parser):
+    parser.add_argument("--nodes", type=str, default="http://127.0.0.1:6000",
+                        help="Comma separated API urls of the cluster nodes")
+    parser.add_argument("--vote-file", type=str, required=True,
+                        help="Signed votes from election_workload.py generate, names the contract and candidates")
+    parser.add_argument("--write-ratio", type=float, default=0.5, help="Share of tasks that cast a vote")
+    parser.add_argument("--register-validators", action="store_true", help="Register every node as a validator")
+    parser.add_argument("--commit-poll-interval", type=float, default=0.5,
+                        help="Seconds between polls of the chain for committed votes")
+    parser.add_argument("--setup-timeout", type=float, default=60, help="Seconds to wait for the election to start")
+
+
+def get_nodes(environment):
+    return [node.strip().rstrip("/") for node in environment.parsed_options.nodes.split(",") if node.strip()]
+
+
+@events.init.add_listener
+def on_init(environment, **kwargs):
+    global votes
+    if environment.parsed_options:
+        vote_file = open(environment.parsed_options.vote_file, "rb")
+        election.update(read_header(vote_file))
+        vote_file.seek(0)
+        votes = read_votes(vote_file)
+
+
+@events.test_start.add_listener
+def on_test_start(environment, **kwargs):
+    if not isinstance(environment.runner, MasterRunner):
+        gevent.spawn(track_commits, environment)
+    if not isinstance(environment.runner, WorkerRunner):
+        setup_election(environment)
+
+
+@events.test_stop.add_listener
+def on_test_stop(environment, **kwargs):
+    if not isinstance(environment.runner, WorkerRunner):
+        finish_election(environment)
+
+
+def setup_election(environment):
+    nodes = get_nodes(environment)
+    contract = election["contract"]
+    if environment.parsed_options.register_validators:
+        for node in nodes:
+            requests.post(f"{node}/validators/register")
+
+    requests.post(f"{nodes[0]}/contracts/new", json={"name": contract})
+    for candidate in election["candidates"]:
+        requests.put(f"{nodes[0]}/contract/candidate", json={"contract": contract, "candidate": candidate})
+    requests.put(f"{nodes[0]}/contract/start", json={"contract": contract})
+
+    deadline = time.time() + environment.parsed_options.setup_timeout
+    while time.time() < deadline:
+        if all(is_election_started(node, contract) for node in nodes):
+            logging.info(f"Election {contract} is started on {len(nodes)} nodes")
+            return
+        time.sleep(0.5)
+    logging.warning(f"Election {contract} is not started on every node after setup timeout")
+
+
+def finish_election(environment):
+    nodes = get_nodes(environment)
+    contract = election["contract"]
+    requests.put(f"{nodes[0]}/contract/finish", json={"contract": contract})
+    deadline = time.time() + environment.parsed_options.setup_timeout
+    while time.time() < deadline:
+        results = requests.get(f"{nodes[0]}/contract/results", json={"contract": contract}).json()
+        if results:
+            logging.info(f"Election {contract} results: {results}")
+            return
+        time.sleep(1)
+    logging.warning(f"Election {contract} results are not committed yet")
+
+
+def track_commits(environment):
+    # Votes are matched by signature against the chain of the first node, so the reported
+    # vote-to-commit latency is accurate up to --commit-poll-interval
+    node = get_nodes(environment)[0]
+    seen_height = 0
+    while True:
+        gevent.sleep(environment.parsed_options.commit_poll_interval)
+        try:
+            chain = requests.get(f"{node}/blockchain").json()["chain"]
+        except Exception as e:
+            logging.exception(e)
+            continue
+        now = time.time()
+        for block in chain[seen_height:]:
+            for tx in block["transactions"]:
+                submitted_at = submitted_votes.pop(tx["signature"], None)
+                if submitted_at is not None:
+                    environment.events.request.fire(request_type="COMMIT", name="vote-to-commit",
+                                                    response_time=(now - submitted_at) * 1000, response_length=0,
+                                                    exception=None, context={})
+        seen_height = len(chain)
+
+
+class ElectionUser(HttpUser):
+    wait_time = between(0.1, 1)
+    host = "http://127.0.0.1:6000"
+
+    def on_start(self):
+        self.nodes = get_nodes(self.environment)
+        self.contract = election["contract"]
+
+    @task
+    def mixed(self):
+        if random.random() < self.environment.parsed_options.write_ratio:
+            self.vote()
+        else:
+            self.read()
+
+    def vote(self):
+        tx = next(votes, None)
+        if tx is None:
+            # Every vote of the vote file is cast
+            self.read()
+            return
+        node = random.choice(self.nodes)
+        with self.client.post(f"{node}/transactions/new", json=tx.to_dict(), name="/transactions/new [vote]",
+                              catch_response=True) as response:
+            if response.status_code == 201:
+                submitted_votes[tx.signature.hex()] = time.time()
+            else:
+                response.failure(f"Vote rejected by {node}: {response.text}")
+
+    def read(self):
+        node = random.choice(self.nodes)
+        endpoint = random.choice(["/contracts", "/contract/candidates", "/transactions", "/blockchain"])
+        if endpoint == "/contract/candidates":
+            self.client.get(f"{node}{endpoint}", json={"contract": self.contract}, name=endpoint)
+        else:
+            self.client.get(f"{node}{endpoint}", name=endpoint)
@@ -0,0 +1,219 @@
+import argparse
+import logging
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from typing import List
+
+import requests
+import rsa
+
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import Transaction
+from src.blockchain.vote_file import VoteFileWriter, encode_vote, read_header, read_votes
+from src.p2p.message import MessageTypes
+from src.p2p.p2p_server import P2PServer
+
+# Pre-generated election workload: distinct voter keys, votes signed offline and written to a vote file,
+# then replayed into a node at a fixed rate.
+#
+# PYTHONPATH=. python src/test/election_workload.py generate --voters 100000 --output election.votes
+# PYTHONPATH=. python src/test/election_workload.py replay --input election.votes --node http://127.0.0.1:6000 \
+#        --setup --rate 500
+
+
+def generate_votes(contract_name: str, candidates: List[str], key_size: int, count: int) -> bytes:
+    # Runs in a worker process, returns encoded records so the parent only writes bytes
+    indexes = {candidate: index for index, candidate in enumerate(candidates)}
+    records = []
+    for _ in range(count):
+        public_key, private_key = rsa.newkeys(key_size)
+        tx = Transaction(public_key, contract_name, ContractMethods.VOTE, [public_key, random.choice(candidates)])
+        tx.sign(private_key)
+        records.append(encode_vote(tx, indexes, key_size // 8))
+    return b"".join(records)
+
+
+def generate(args):
+    candidates = [f"Candidate {i}" for i in range(args.candidates)]
+    chunks = [args.chunk_size] * (args.voters // args.chunk_size)
+    if args.voters % args.chunk_size:
+        chunks.append(args.voters % args.chunk_size)
+    started = time.time()
+    written = 0
+    with open(args.output, "wb") as f, multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+        writer = VoteFileWriter(f, args.contract, candidates, args.key_size // 8)
+        jobs = ((args.contract, candidates, args.key_size, count) for count in chunks)
+        for count, records in zip(chunks, pool.imap(unpack_generate_votes, jobs)):
+            writer.write_encoded(records)
+            written += count
+            logging.info(f"{written}/{args.voters} votes, {written / (time.time() - started):.0f} votes/s")
+    logging.info(f"Wrote {written} votes for {args.contract} to {args.output} in {time.time() - started:.1f}s")
+
+
+def unpack_generate_votes(job):
+    return generate_votes(*job)
+
+
+class Throughput:
+    # Paces senders to a shared rate and reports accepted transactions per second
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.scheduled = 0
+        self.sent = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def wait_for_slot(self, count: int):
+        with self.lock:
+            due = self.started + self.scheduled / self.rate if self.rate else 0
+            self.scheduled += count
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record(self, sent: int, accepted: int, rejected: int):
+        with self.lock:
+            self.sent += sent
+            self.accepted += accepted
+            self.rejected += rejected
+
+    def report(self) -> str:
+        elapsed = time.time() - self.started
+        return f"sent {self.sent}, accepted {self.accepted}, rejected {self.rejected} in {elapsed:.1f}s, " \
+               f"{self.sent / elapsed:.0f} tx/s sent, {self.accepted / elapsed:.0f} tx/s accepted"
+
+
+def setup_election(node: str, header: dict):
+    requests.post(f"{node}/validators/register")
+    requests.post(f"{node}/contracts/new", json={"name": header["contract"]})
+    for candidate in header["candidates"]:
+        requests.put(f"{node}/contract/candidate", json={"contract": header["contract"], "candidate": candidate})
+    requests.put(f"{node}/contract/start", json={"contract": header["contract"]})
+    # Votes are only valid once the start is committed
+    while not is_election_started(node, header["contract"]):
+        time.sleep(0.5)
+
+
+def is_election_started(node: str, contract: str) -> bool:
+    # /contracts already lists a contract whose CREATE is pending, the START_VOTING has to be on the main chain
+    params = {"contract": contract, "method": ContractMethods.START_VOTING}
+    return bool(requests.get(f"{node}/export/transactions", params=params, timeout=30).text.strip())
+
+
+def send_api_batches(node: str, batches, batches_lock: threading.Lock, throughput: Throughput, on_send=None):
+    # on_send is called with the transactions of every request right before it is sent
+    session = requests.Session()
+    while True:
+        with batches_lock:
+            batch = next(batches, None)
+        if batch is None:
+            return
+        throughput.wait_for_slot(len(batch))
+        while batch:
+            if on_send is not None:
+                on_send(batch)
+            response = session.post(f"{node}/transactions/bulk", json={"transactions": batch})
+            if response.status_code not in (201, 429):
+                logging.warning(f"Bulk request failed with {response.status_code}: {response.text}")
+                throughput.record(len(batch), 0, len(batch))
+                break
+            result = response.json()
+            throughput.record(result["processed"], result["accepted"], result["rejected"])
+            batch = batch[result["processed"]:]
+            if response.status_code == 429:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+
+
+def send_p2p_messages(address, transactions, transactions_lock: threading.Lock, throughput: Throughput):
+    # One connection per message, the framing of the node protocol. The node doesn't answer, so delivered messages
+    # count as accepted, and transactions arriving over P2P don't start a consensus round by themselves
+    host, port = address
+    while True:
+        with transactions_lock:
+            tx = next(transactions, None)
+        if tx is None:
+            return
+        throughput.wait_for_slot(1)
+        message = P2PServer.encode_message({'type': MessageTypes.NEW_TRANSACTION, 'transaction': tx})
+        try:
+            with socket.create_connection((host, port), timeout=30) as s:
+                s.sendall(message)
+            throughput.record(1, 1, 0)
+        except OSError as e:
+            logging.warning(f"Sending to {host}:{port} failed: {e}")
+            throughput.record(1, 0, 1)
+
+
+def batched(iterator, size: int):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def replay(args):
+    with open(args.input, "rb") as f:
+        header = read_header(f)
+    if args.setup:
+        setup_election(args.node, header)
+
+    throughput = Throughput(args.rate)
+    with open(args.input, "rb") as f:
+        transactions = (tx.to_dict() for tx in read_votes(f))
+        lock = threading.Lock()
+        if args.p2p:
+            host, port = args.p2p.split(":")
+            target, target_args = send_p2p_messages, ((host, int(port)), transactions, lock, throughput)
+        else:
+            batches = batched(transactions, args.batch_size)
+            target, target_args = send_api_batches, (args.node, batches, lock, throughput)
+        senders = [threading.Thread(target=target, args=target_args, daemon=True) for _ in range(args.connections)]
+        for sender in senders:
+            sender.start()
+        while any(sender.is_alive() for sender in senders):
+            time.sleep(args.report_interval)
+            logging.info(throughput.report())
+    logging.info(f"Replay finished: {throughput.report()}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Generate and replay pre-signed election workloads")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Generate voter keys and signed votes")
+    generate_parser.add_argument("--voters", type=int, default=10000, help="Number of distinct voters")
+    generate_parser.add_argument("--contract", type=str, default="Election", help="Contract name")
+    generate_parser.add_argument("--candidates", type=int, default=3, help="Number of candidates")
+    generate_parser.add_argument("--key-size", type=int, default=512, help="Voter key size in bits")
+    generate_parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                                 help="Processes generating keys and signatures")
+    generate_parser.add_argument("--chunk-size", type=int, default=500, help="Votes generated per task")
+    generate_parser.add_argument("--output", type=str, required=True, help="Vote file to write")
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a vote file into a node")
+    replay_parser.add_argument("--input", type=str, required=True, help="Vote file to read")
+    replay_parser.add_argument("--node", type=str, default="http://127.0.0.1:6000", help="API url of the node")
+    replay_parser.add_argument("--p2p", type=str,
+                               help="host:port to send NEW_TRANSACTION messages to instead of the bulk API")
+    replay_parser.add_argument("--setup", action="store_true",
+                               help="Register the node as validator, create and start the election first")
+    replay_parser.add_argument("--rate", type=float, default=0, help="Transactions per second, 0 is unlimited")
+    replay_parser.add_argument("--batch-size", type=int, default=100, help="Transactions per bulk API request")
+    replay_parser.add_argument("--connections", type=int, default=4, help="Concurrent senders")
+    replay_parser.add_argument("--report-interval", type=float, default=1, help="Seconds between reports")
+
+    parsed = parser.parse_args()
+    if parsed.command == "generate":
+        generate(parsed)
+    else:
+        replay(parsed)
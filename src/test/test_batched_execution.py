@@ -0,0 +1,88 @@
+import random
+import unittest
+
+from rsa import PublicKey
+
+from src.blockchain.block import Block
+from src.blockchain.blockchain import Blockchain
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import Transaction
+
+CONTRACTS = ["A", "B", "C"]
+CANDIDATES = ["x", "y", "z"]
+
+
+def random_key(rng: random.Random) -> PublicKey:
+    # Keys are only compared and hashed during execution, a random modulus is enough
+    return PublicKey(rng.getrandbits(256) | 1, 65537)
+
+
+def random_block(rng: random.Random, voters, size: int) -> Block:
+    transactions = []
+    for _ in range(size):
+        contract_name = rng.choice(CONTRACTS)
+        roll = rng.random()
+        if roll < 0.05:
+            transactions.append(Transaction(random_key(rng), contract_name, ContractMethods.CREATE, []))
+        elif roll < 0.12:
+            # Includes duplicates and candidates added after the start
+            candidate = rng.choice(CANDIDATES)
+            transactions.append(Transaction(random_key(rng), contract_name, ContractMethods.ADD_CANDIDATE, [candidate]))
+        elif roll < 0.15:
+            transactions.append(Transaction(random_key(rng), contract_name, ContractMethods.START_VOTING, []))
+        elif roll < 0.17:
+            transactions.append(Transaction(random_key(rng), contract_name, ContractMethods.FINISH_VOTING, []))
+        else:
+            # Repeated voters, unknown candidates and malformed arguments are rejected on both paths
+            voter_key = rng.choice(voters)
+            candidate = rng.choice(CANDIDATES + ["unknown"])
+            args = [voter_key, candidate] if rng.random() > 0.02 else [voter_key]
+            transactions.append(Transaction(voter_key, contract_name, ContractMethods.VOTE, args))
+    return Block(transactions, "0", 0)
+
+
+class BatchedExecutionTest(unittest.TestCase):
+    def assert_same_state(self, sequential: Blockchain, batched: Blockchain):
+        self.assertEqual(list(sequential.contracts), list(batched.contracts))
+        for name, contract in sequential.contracts.items():
+            other = batched.contracts[name]
+            self.assertEqual(contract.state, other.state)
+            self.assertEqual(list(contract.candidates.items()), list(other.candidates.items()))
+            self.assertEqual(list(contract.votes.items()), list(other.votes.items()))
+
+    def test_matches_sequential_execution(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            voters = [random_key(rng) for _ in range(150)]
+            sequential, batched = Blockchain(), Blockchain()
+            undo_logs = []
+            for _ in range(10):
+                block = random_block(rng, voters, 100)
+                sequential_undo = sequential.execute_sequentially(block)
+                batched_undo = batched.execute_batched(block)
+                self.assertEqual(sequential_undo, batched_undo)
+                self.assert_same_state(sequential, batched)
+                undo_logs.append(batched_undo)
+            # The undo entries of the batched path roll the state back the same way
+            for undo in reversed(undo_logs):
+                batched.rollback_contracts(undo)
+            self.assertEqual(batched.contracts, {})
+
+    def test_votes_of_one_block_are_counted_once_per_voter(self):
+        rng = random.Random(0)
+        blockchain = Blockchain()
+        owner = random_key(rng)
+        voter = random_key(rng)
+        transactions = [Transaction(owner, "A", ContractMethods.CREATE, []),
+                        Transaction(owner, "A", ContractMethods.ADD_CANDIDATE, ["x"]),
+                        Transaction(owner, "A", ContractMethods.ADD_CANDIDATE, ["y"]),
+                        Transaction(owner, "A", ContractMethods.START_VOTING, []),
+                        Transaction(voter, "A", ContractMethods.VOTE, [voter, "x"]),
+                        Transaction(voter, "A", ContractMethods.VOTE, [voter, "y"])]
+        undo = blockchain.execute_batched(Block(transactions, "0", 0))
+        self.assertEqual(blockchain.contracts["A"].candidates, {"x": 1, "y": 0})
+        self.assertEqual(undo[-1], (ContractMethods.VOTE, "A", voter))
+
+
+if __name__ == '__main__':
+    unittest.main()
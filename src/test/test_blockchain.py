@@ -0,0 +1,74 @@
+import unittest
+
+import rsa
+
+from src.blockchain.block import Block
+from src.blockchain.blockchain import Blockchain
+from src.blockchain.contract_methods import ContractMethods
+from src.blockchain.transaction import Transaction, get_key_fingerprint
+
+
+def signed_transaction(contract_name: str, contract_method: str, args=None) -> Transaction:
+    public_key, private_key = rsa.newkeys(512)
+    tx = Transaction(public_key, contract_name, contract_method, args if args is not None else [])
+    tx.sign(private_key)
+    return tx
+
+
+def signed_vote(contract_name: str, keys, candidate: str) -> Transaction:
+    public_key, private_key = keys
+    tx = Transaction(public_key, contract_name, ContractMethods.VOTE, [public_key, candidate])
+    tx.sign(private_key)
+    return tx
+
+
+class BlockVerificationTest(unittest.TestCase):
+    def test_rejects_a_repeated_transaction_with_the_same_hash(self):
+        a, b, c = [signed_transaction("Election", ContractMethods.ADD_CANDIDATE, [name]) for name in "abc"]
+        block = Block([a, b, c], "0", 1)
+        altered = Block([a, b, c, c], "0", 1)
+        self.assertEqual(block.hash, altered.hash)
+        self.assertTrue(Blockchain.verify_block(block))
+        self.assertFalse(Blockchain.verify_block(altered))
+
+
+class ForkSwitchTest(unittest.TestCase):
+    def test_switches_to_a_longer_branch(self):
+        blockchain = Blockchain()
+        genesis = blockchain.last_block
+        setup = Block([signed_transaction("Election", ContractMethods.CREATE),
+                       signed_transaction("Election", ContractMethods.ADD_CANDIDATE, ["x"]),
+                       signed_transaction("Election", ContractMethods.ADD_CANDIDATE, ["y"]),
+                       signed_transaction("Election", ContractMethods.START_VOTING)], genesis.hash, 1)
+        self.assertTrue(blockchain.add_existing_block(setup))
+
+        voter, other_voter = rsa.newkeys(512), rsa.newkeys(512)
+        vote, other_vote, changed_vote = signed_vote("Election", voter, "x"), \
+            signed_vote("Election", other_voter, "x"), signed_vote("Election", voter, "y")
+        losing = Block([vote, other_vote], setup.hash, 2)
+        self.assertTrue(blockchain.add_existing_block(losing))
+        self.assertEqual(blockchain.contracts["Election"].candidates, {"x": 2, "y": 0})
+
+        winning = Block([changed_vote], setup.hash, 3)
+        self.assertFalse(blockchain.add_existing_block(winning))
+        extension = Block([], winning.hash, 4)
+        self.assertTrue(blockchain.add_existing_block(extension))
+
+        self.assertEqual(blockchain.chain, [genesis, setup, winning, extension])
+        self.assertEqual(blockchain.contracts["Election"].candidates, {"x": 0, "y": 1})
+        self.assertEqual(blockchain.contracts["Election"].votes, {voter[0]: "y"})
+        # The rolled back vote of the voter counted on the winning branch isn't pending again, the other one is
+        self.assertEqual(blockchain.pending_transactions, [other_vote])
+
+        self.assertIsNone(blockchain.index.get_block_height(losing.hash))
+        self.assertEqual(blockchain.index.get_block_height(extension.hash), 3)
+        self.assertIsNone(blockchain.index.get_transaction_location(vote.get_id()))
+        self.assertIsNone(blockchain.index.get_transaction_location(other_vote.get_id()))
+        self.assertEqual(blockchain.index.get_transaction_location(changed_vote.get_id()), [2, 0])
+        self.assertEqual(blockchain.index.get_vote_transaction_id("Election", get_key_fingerprint(voter[0])),
+                         changed_vote.get_id())
+        self.assertIsNone(blockchain.index.get_vote_transaction_id("Election", get_key_fingerprint(other_voter[0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
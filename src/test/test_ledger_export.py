@@ -0,0 +1,32 @@
+import unittest
+
+import rsa
+
+from src.api import ledger_export
+from src.blockchain.block import Block
+from src.blockchain.blockchain import Blockchain
+from src.blockchain.contract_methods import ContractMethods
+from src.test.test_blockchain import signed_transaction, signed_vote
+
+
+class VoteExportTest(unittest.TestCase):
+    def test_marks_votes_the_contract_did_not_count(self):
+        blockchain = Blockchain()
+        setup = Block([signed_transaction("Election", ContractMethods.CREATE),
+                       signed_transaction("Election", ContractMethods.ADD_CANDIDATE, ["x"]),
+                       signed_transaction("Election", ContractMethods.ADD_CANDIDATE, ["y"]),
+                       signed_transaction("Election", ContractMethods.START_VOTING)], blockchain.last_block.hash, 1)
+        self.assertTrue(blockchain.add_existing_block(setup))
+        voter = rsa.newkeys(512)
+        vote, repeated_vote = signed_vote("Election", voter, "x"), signed_vote("Election", voter, "y")
+        self.assertTrue(blockchain.add_existing_block(Block([vote], setup.hash, 2)))
+        self.assertTrue(blockchain.add_existing_block(Block([repeated_vote], blockchain.last_block.hash, 3)))
+
+        votes = list(ledger_export.iter_votes(blockchain, "Election", 0))
+        self.assertEqual([(v["transaction_id"], v["counted"]) for v in votes],
+                         [(vote.get_id(), True), (repeated_vote.get_id(), False)])
+        self.assertEqual(blockchain.contracts["Election"].candidates, {"x": 1, "y": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import errno
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.blockchain.write_ahead_log import DurabilityMode, RecordTypes, WriteAheadLog, WriteAheadLogError
+
+
+class WriteAheadLogTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "wal.log")
+
+    def append(self, *records):
+        wal = WriteAheadLog(self.path, DurabilityMode.REQUEST)
+        for record in records:
+            wal.append(RecordTypes.TRANSACTION, record)
+        wal.close()
+
+    def test_replays_records_appended_after_a_torn_write(self):
+        self.append({"n": 1}, {"n": 2})
+        with open(self.path, "a") as f:
+            f.write('{"type": "transaction", "data": {"n": 3')
+        self.assertEqual([data for _, data in WriteAheadLog.read(self.path)], [{"n": 1}, {"n": 2}])
+
+        self.append({"n": 4})
+        self.append({"n": 5})
+        self.assertEqual([data for _, data in WriteAheadLog.read(self.path)], [{"n": 1}, {"n": 2}, {"n": 4}, {"n": 5}])
+
+    def test_drops_a_complete_record_without_its_newline(self):
+        self.append({"n": 1})
+        with open(self.path, "a") as f:
+            f.write('{"type": "transaction", "data": {"n": 2}}')
+        self.append({"n": 3})
+        self.assertEqual([data for _, data in WriteAheadLog.read(self.path)], [{"n": 1}, {"n": 3}])
+
+    def test_fails_appends_once_an_fsync_failed(self):
+        for mode in (DurabilityMode.BATCHED, DurabilityMode.REQUEST):
+            wal = WriteAheadLog(self.path, mode)
+            with mock.patch("os.fsync", side_effect=OSError(errno.EIO, "I/O error")):
+                with self.assertRaises(WriteAheadLogError):
+                    wal.append(RecordTypes.TRANSACTION, {"n": 1})
+            # Later fsyncs may succeed without the lost pages, so the log stays failed
+            with self.assertRaises(WriteAheadLogError):
+                wal.append(RecordTypes.TRANSACTION, {"n": 2})
+            wal.file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()